@@ -0,0 +1,471 @@
+"""Нагрузочный стенд arena API.
+
+Заполняет arena.db и arena_community.db во временном каталоге синтетическими моделями, событиями
+и ставками, поднимает main_gpt под uvicorn (model-chat - через локальную заглушку OpenAI) и гоняет
+сценарии: HTTP-опрос горячих эндпоинтов, рассылку по WebSocket, пачки расчётов, активацию
+событий планировщиком и model-chat. Для каждого сценария - p50/p99 и пропускная способность.
+
+    python benchmarks/harness.py --events 2000 --clients 50 --out result.json
+    python benchmarks/harness.py --baseline result.json --tolerance 0.25   # код выхода 1 при регрессии
+
+WebSocket-сценарии требуют пакет websockets (он же нужен uvicorn для /ws/*).
+"""
+import argparse, asyncio, json, os, platform, random, socket, subprocess, sys, tempfile, time, uuid
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import func, insert, select, update
+
+try:
+    import websockets
+except ImportError:  # без него WebSocket-сценарии пропускаются
+    websockets = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+POLL_PATHS = [
+    "/events/current",
+    "/leaderboard",
+    "/models",
+    "/events/history?limit=20",
+    "/community/events/current",
+    "/community/leaderboard",
+    "/community/events/history?limit=20",
+]
+
+# -------------------------
+# Seeding
+# -------------------------
+def seed_market(m, market, events: int, extra_models: int = 0):
+    """Синтетическая история рынка: рассчитанные события со ставками всех моделей, история баланса
+    и одно активное событие. Балансы моделей согласованы со ставками"""
+    M, E, B, H = market.model_cls, market.event_cls, market.bet_cls, market.history_cls
+    fields = {"main": {"market_link": "https://polymarket.com/event/bench"},
+              "community": {"username": "bench", "twitter_link": "https://x.com/bench"}}.get(market.name, {})
+    db = market.SessionLocal()
+    existing = {row[0] for row in db.execute(select(M.id))}
+    new_models = [{"id": f"bench_{i}", "name": f"Bench {i}"} for i in range(extra_models) if f"bench_{i}" not in existing]
+    if new_models:
+        db.execute(insert(M), new_models)
+    models = {row[0]: dict(zip(m.MODEL_FIELDS, row))
+              for row in db.execute(select(*[getattr(M, name) for name in m.MODEL_FIELDS]))}
+
+    next_id = (db.execute(select(func.max(E.id))).scalar() or 0) + 1
+    now = datetime.utcnow()
+    event_rows, bet_rows, history_rows = [], [], []
+    for i in range(events):
+        event_id = next_id + i
+        active = i == events - 1
+        start = now - timedelta(minutes=10 * (events - i)) if not active else now
+        result = None if active else random.choice(list(m.SideEnum))
+        bets = [(model_id, random.choice(list(m.SideEnum)), random.randint(100, 500)) for model_id in models]
+        losers_pool = sum(amount for _, side, amount in bets if side != result)
+        winners_pool = sum(amount for _, side, amount in bets if side == result) or 1
+        for model_id, side, amount in bets:
+            profit = None
+            if not active:
+                model = models[model_id]
+                profit = amount / winners_pool * losers_pool if side == result else -amount
+                model["balance"] += profit
+                model["wins"] += side == result
+                model["biggest_win"] = max(model["biggest_win"], profit)
+                model["biggest_loss"] = min(model["biggest_loss"], profit)
+                history_rows.append({"model_id": model_id, "event_id": event_id, "timestamp": start + timedelta(minutes=10),
+                                     "balance": model["balance"], "profit": profit, "wins": model["wins"],
+                                     "total_bets": model["total_bets"] + i + 1})
+            bet_rows.append({"model_id": model_id, "event_id": event_id, "side": side, "amount": amount, "profit": profit})
+        event_rows.append({
+            "id": event_id, "description": f"Benchmark event {event_id}", **fields,
+            "start_time": start, "end_time": start + timedelta(days=1 if active else 0, minutes=10),
+            "status": "active" if active else "finished", "result": result, "duration_minutes": 10,
+            "total_yes": sum(a for _, s, a in bets if s == m.SideEnum.YES),
+            "total_no": sum(a for _, s, a in bets if s == m.SideEnum.NO),
+            "bets_count": len(bets),
+        })
+
+    if event_rows:
+        db.execute(insert(E), event_rows)
+        db.execute(insert(B), bet_rows)
+    if history_rows:
+        db.execute(insert(H), history_rows)
+    for model in models.values():
+        db.execute(update(M).where(M.id == model["id"]).values(
+            balance=model["balance"], wins=model["wins"], total_bets=model["total_bets"] + events,
+            biggest_win=model["biggest_win"], biggest_loss=model["biggest_loss"],
+        ))
+    db.commit()
+    db.close()
+    return {"models": len(models), "events": len(event_rows), "bets": len(bet_rows), "history": len(history_rows)}
+
+def seed_databases(workdir: str, events: int, extra_models: int):
+    """main_gpt создаёт базы в текущем каталоге - поэтому готовим и сидим их из workdir"""
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.path.insert(0, ROOT)
+        import main_gpt as m
+        m.prepare_databases()
+        counts = {market.name: seed_market(m, market, events, extra_models) for market in m.MARKETS}
+        for market in m.MARKETS:
+            market.engine.dispose()
+        return counts
+    finally:
+        os.chdir(cwd)
+
+# -------------------------
+# Processes
+# -------------------------
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_process(args, cwd: str, env: dict):
+    return subprocess.Popen(args, cwd=cwd, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+async def wait_ready(url: str, process, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited: {process.stderr.read().decode()[-2000:]}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not start in {timeout}s")
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+# -------------------------
+# Measurements
+# -------------------------
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        samples = sorted(self.samples)
+
+        def percentile(q):
+            return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000 if samples else None
+
+        return {
+            "count": len(samples),
+            "errors": self.errors,
+            "throughput": len(samples) / elapsed if elapsed > 0 else 0,
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "max_ms": samples[-1] * 1000 if samples else None,
+        }
+
+async def create_active_events(client: httpx.AsyncClient, count: int, recorder: "Recorder", prefix: str = ""):
+    """Создаёт события с немедленным стартом и ждёт, пока планировщик их активирует и расставит ставки.
+    Не дождавшиеся активации события - ошибки сценария, а не тихо выпавшие из замера"""
+    ids = []
+    for i in range(count):
+        r = await client.post(f"{prefix}/events", json=event_payload(prefix, f"Burst {uuid.uuid4().hex[:8]}"))
+        ids.append(r.json()["id"])
+    pending = set(ids)
+    deadline = time.monotonic() + 30
+    while pending and time.monotonic() < deadline:
+        r = await client.get(f"{prefix}/events/history", params={"limit": 200, "fields": "id,status,bets_count"})
+        pending -= {e["id"] for e in r.json() if e["status"] == "active" and e["bets_count"]}
+        await asyncio.sleep(0.1)
+    if pending:
+        print(f"  {len(pending)} of {count} events were not activated within 30s")
+        recorder.errors += len(pending)
+    return [event_id for event_id in ids if event_id not in pending]
+
+def event_payload(prefix: str, description: str, start_in_seconds: int = 0):
+    payload = {"description": description, "start_in_seconds": start_in_seconds}
+    if prefix == "/community":
+        payload.update(username="bench", twitter_link="https://x.com/bench")
+    return payload
+
+# -------------------------
+# Scenarios
+# -------------------------
+async def http_polling(base: str, args):
+    """Клиенты по кругу опрашивают горячие GET-эндпоинты обоих рынков"""
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=30) as client:
+        async def poller(offset):
+            deadline = time.perf_counter() + args.duration
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    r = await client.get(POLL_PATHS[i % len(POLL_PATHS)])
+                    if r.status_code >= 400:
+                        recorder.errors += 1
+                    else:
+                        recorder.add(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    recorder.errors += 1
+                i += 1
+
+        await asyncio.gather(*(poller(i) for i in range(args.clients)))
+    recorder.stop()
+    return recorder.summary()
+
+async def feed_messages(ws):
+    async for raw in ws:
+        yield json.loads(raw)
+
+async def ws_fanout(base: str, args):
+    """Задержка от PATCH расчёта до получения event_settled каждым подписчиком /ws/feed"""
+    recorder = Recorder()
+    ws_url = base.replace("http", "ws", 1) + "/ws/feed"
+    async with httpx.AsyncClient(base_url=base, timeout=30) as client:
+        event_ids = await create_active_events(client, args.rounds, recorder)
+        sent = {}
+        expected = len(event_ids)
+
+        async def subscriber(ready: asyncio.Event, connected: list):
+            async with websockets.connect(ws_url, max_queue=None) as ws:
+                connected.append(ws)
+                if len(connected) == args.ws_clients:
+                    ready.set()
+                received = 0
+                async for message in feed_messages(ws):
+                    if message["type"] == "event_settled" and message["data"]["event_id"] in sent:
+                        recorder.add(time.perf_counter() - sent[message["data"]["event_id"]])
+                        received += 1
+                        if received == expected:
+                            return
+
+        ready, connected = asyncio.Event(), []
+        recorder.started = time.perf_counter()
+        tasks = [asyncio.create_task(subscriber(ready, connected)) for _ in range(args.ws_clients)]
+        await asyncio.wait_for(ready.wait(), 30)
+        for event_id in event_ids:
+            sent[event_id] = time.perf_counter()
+            await client.patch(f"/events/{event_id}/result", json={"result": random.choice(["YES", "NO"])})
+        done, pending = await asyncio.wait(tasks, timeout=30)
+        for task in pending:
+            task.cancel()
+        recorder.errors += args.ws_clients * expected - len(recorder.samples)
+    recorder.stop()
+    return recorder.summary()
+
+async def settlement_burst(base: str, args):
+    """Все события пачки рассчитываются одновременно, каждое - дважды, как повтор с другого воркера.
+    Ошибка - не ровно одна выплата на событие или повтор по Idempotency-Key с другим ответом"""
+    recorder = Recorder()
+    async with httpx.AsyncClient(base_url=base, timeout=60,
+                                 limits=httpx.Limits(max_connections=2 * args.burst)) as client:
+        event_ids = await create_active_events(client, args.burst, recorder)
+        responses = {}
+
+        async def settle(event_id, key):
+            start = time.perf_counter()
+            r = await client.patch(f"/events/{event_id}/result", json={"result": "YES"},
+                                   headers={"Idempotency-Key": key})
+            if r.status_code != 200:
+                recorder.errors += 1
+                return
+            recorder.add(time.perf_counter() - start)
+            responses[key] = r.json()
+
+        recorder.started = time.perf_counter()
+        keys = {event_id: (uuid.uuid4().hex, uuid.uuid4().hex) for event_id in event_ids}
+        await asyncio.gather(*(settle(event_id, key) for event_id in event_ids for key in keys[event_id]))
+        recorder.stop()
+
+        for event_id, (first, second) in keys.items():
+            outcomes = sorted(responses[key]["outcome"] for key in (first, second) if key in responses)
+            recorder.errors += outcomes != ["already_settled", "settled"]
+            replay = await client.patch(f"/events/{event_id}/result", json={"result": "YES"},
+                                        headers={"Idempotency-Key": first})
+            recorder.errors += replay.json() != responses.get(first)
+    return recorder.summary()
+
+async def scheduler_activation(base: str, args):
+    """Запаздывание event_activated относительно запланированного старта"""
+    recorder = Recorder()
+    ws_url = base.replace("http", "ws", 1) + "/ws/feed"
+    async with httpx.AsyncClient(base_url=base, timeout=30) as client, \
+            websockets.connect(ws_url, max_queue=None) as ws:
+        await ws.recv()  # снимок
+        due = {}
+        for i in range(args.activations):
+            start_in = 1 + i % 3
+            r = await client.post("/events", json=event_payload("", f"Scheduled {i}", start_in))
+            due[r.json()["id"]] = time.perf_counter() + start_in
+
+        recorder.started = time.perf_counter()
+        try:
+            async with asyncio.timeout(30):
+                async for message in feed_messages(ws):
+                    if message["type"] == "event_activated" and message["data"]["id"] in due:
+                        recorder.add(max(0.0, time.perf_counter() - due.pop(message["data"]["id"])))
+                        if not due:
+                            break
+        except TimeoutError:
+            pass
+        recorder.errors = len(due)
+    recorder.stop()
+    return recorder.summary()
+
+async def model_chat(base: str, args):
+    """Параллельные /model-chat с уникальными вопросами (мимо кэша) через заглушку OpenAI"""
+    recorder = Recorder()
+    personas = ["gpt", "claude", "gemini_pro", "grok", "deepseek", "qwen_max"]
+    async with httpx.AsyncClient(base_url=base, timeout=60,
+                                 limits=httpx.Limits(max_connections=args.chat_clients)) as client:
+        async def chatter(i):
+            deadline = time.perf_counter() + args.duration
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                r = await client.post("/model-chat", json={
+                    "model_id": personas[i % len(personas)],
+                    "question": f"Will benchmark {uuid.uuid4().hex} resolve YES?",
+                })
+                if r.status_code != 200 or r.json()["answer"].startswith("Error"):
+                    recorder.errors += 1
+                else:
+                    recorder.add(time.perf_counter() - start)
+
+        await asyncio.gather(*(chatter(i) for i in range(args.chat_clients)))
+    recorder.stop()
+    return recorder.summary()
+
+SCENARIOS = {
+    "http_polling": (http_polling, False),
+    "ws_fanout": (ws_fanout, True),
+    "settlement_burst": (settlement_burst, False),
+    "scheduler_activation": (scheduler_activation, True),
+    "model_chat": (model_chat, False),
+}
+
+# -------------------------
+# Baseline comparison
+# -------------------------
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Регрессия - p99 выросла или пропускная способность упала больше чем на tolerance"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        if before.get("p99_ms") and current.get("p99_ms") and current["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {before['p99_ms']:.1f} -> {current['p99_ms']:.1f} ms")
+        if before.get("throughput") and current["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {current['throughput']:.1f} /s")
+        if current["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}: errors {before.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+def print_report(results: dict):
+    print(f"\n{'scenario':<24}{'count':>8}{'errors':>8}{'throughput/s':>14}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, s in results["scenarios"].items():
+        fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+        print(f"{name:<24}{s['count']:>8}{s['errors']:>8}{s['throughput']:>14.1f}{fmt(s['p50_ms'])}{fmt(s['p99_ms'])}")
+
+# -------------------------
+# Entry point
+# -------------------------
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="arena-bench-")
+    print(f"Seeding {workdir} ...")
+    seeded = seed_databases(workdir, args.events, args.models)
+    print(f"Seeded: {seeded}")
+
+    stub_port, app_port = free_port(), free_port()
+    stub = start_process([sys.executable, "-m", "uvicorn", "openai_stub:app", "--port", str(stub_port),
+                          "--log-level", "warning"], BENCH_DIR,
+                         {"STUB_LATENCY": str(args.llm_latency)})
+    bus = {"EVENT_BUS": "redis", "EVENT_BUS_URL": args.event_bus_url} if args.event_bus_url else {}
+    app = start_process([sys.executable, "-m", "uvicorn", "main_gpt:app", "--port", str(app_port),
+                         "--log-level", "warning", "--workers", str(args.workers)], workdir, {
+        **bus,
+        "PYTHONPATH": ROOT,
+        "LLM_BACKEND": "openai",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "OPENAI_API_KEY": "bench",
+    })
+    base = f"http://127.0.0.1:{app_port}"
+    results = {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "out", "only")},
+        "seeded": seeded,
+        "scenarios": {},
+    }
+    try:
+        await wait_ready(f"http://127.0.0.1:{stub_port}/docs", stub)
+        await wait_ready(f"{base}/ready", app)
+        for name, (scenario, needs_ws) in SCENARIOS.items():
+            if args.only and name not in args.only:
+                continue
+            if needs_ws and websockets is None:
+                print(f"- {name}: skipped (pip install websockets)")
+                continue
+            print(f"- {name} ...")
+            results["scenarios"][name] = await scenario(base, args)
+    finally:
+        stop_process(app)
+        stop_process(stub)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1000, help="рассчитанных событий на рынок")
+    parser.add_argument("--models", type=int, default=0, help="дополнительных синтетических моделей")
+    parser.add_argument("--duration", type=float, default=10, help="длительность опроса и model-chat, с")
+    parser.add_argument("--clients", type=int, default=50, help="параллельных HTTP-клиентов")
+    parser.add_argument("--ws-clients", type=int, default=200, help="подписчиков /ws/feed")
+    parser.add_argument("--rounds", type=int, default=10, help="расчётов в сценарии рассылки")
+    parser.add_argument("--burst", type=int, default=50, help="событий в пачке расчётов")
+    parser.add_argument("--activations", type=int, default=50, help="событий для планировщика")
+    parser.add_argument("--chat-clients", type=int, default=20, help="параллельных model-chat клиентов")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="задержка заглушки OpenAI, с")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn (больше одного - только с --event-bus-url)")
+    parser.add_argument("--event-bus-url", help="Redis для EVENT_BUS=redis приложения, например redis://localhost:6379/0")
+    parser.add_argument("--only", nargs="*", choices=list(SCENARIOS), help="запустить только эти сценарии")
+    parser.add_argument("--out", help="сохранить результаты в JSON (годится как baseline)")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+    # Без общей шины воркеры не видят записей друг друга: замеры были бы по устаревшим кэшам (приложение и не станет ready)
+    if args.workers > 1 and not args.event_bus_url:
+        parser.error("--workers > 1 requires --event-bus-url (a shared EVENT_BUS for the app)")
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
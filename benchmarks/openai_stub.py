@@ -0,0 +1,58 @@
+"""Локальная заглушка OpenAI Chat Completions API для нагрузочных тестов model-chat.
+
+Отвечает эхом вопроса с задержкой STUB_LATENCY и, при stream=true, отдаёт токены
+через SSE в формате OpenAI с паузой STUB_TOKEN_DELAY. Если системный промпт просит JSON
+(ставка агента), отвечает случайной ставкой {"side", "amount", "reasoning"}. Приложение подключается к ней через
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 и идёт через настоящий AsyncOpenAI-клиент.
+
+    python -m uvicorn openai_stub:app --port 8900
+"""
+import asyncio, json, os, random, time, uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+LATENCY = float(os.getenv("STUB_LATENCY", "0.2"))
+TOKEN_DELAY = float(os.getenv("STUB_TOKEN_DELAY", "0.005"))
+
+app = FastAPI()
+
+def chunk(completion_id: str, model: str, delta: dict, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    answer = f"[stub] {body['messages'][-1]['content']}"
+    if "JSON" in body["messages"][0]["content"]:
+        answer = json.dumps({"side": random.choice(["YES", "NO"]), "amount": random.randint(100, 500), "reasoning": answer})
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await asyncio.sleep(LATENCY)
+
+    if body.get("stream"):
+        async def events():
+            yield f"data: {json.dumps(chunk(completion_id, model, {'role': 'assistant', 'content': ''}))}\n\n"
+            for i, word in enumerate(answer.split(" ")):
+                if i:
+                    await asyncio.sleep(TOKEN_DELAY)
+                token = word if i == 0 else " " + word
+                yield f"data: {json.dumps(chunk(completion_id, model, {'content': token}))}\n\n"
+            yield f"data: {json.dumps(chunk(completion_id, model, {}, 'stop'))}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
@@ -0,0 +1,116 @@
+"""Микробенчмарк сериализации горячих GET-эндпоинтов.
+
+Сравнивает прежний путь (ORM-объекты -> Pydantic-схемы -> jsonable_encoder -> json.dumps)
+с текущим (кортежи SQL -> dict -> orjson) на промахе кэша ответов - это и есть
+стоимость ответа для одного воркера после каждой записи в рынок.
+
+    python benchmarks/serialization.py --events 500 --seconds 2
+"""
+import argparse, json, os, sys, tempfile, time
+
+from harness import seed_market
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def legacy_encode(data) -> bytes:
+    from fastapi.encoders import jsonable_encoder
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def legacy_event(market, event, bets):
+    return market.tables.event_schema(
+        id=event.id,
+        description=event.description,
+        **{name: getattr(event, name) for name in market.tables.event_fields},
+        start_time=event.start_time,
+        end_time=event.end_time,
+        status=event.status,
+        result=event.result,
+        total_yes=event.total_yes,
+        total_no=event.total_no,
+        bets_count=event.bets_count,
+        bets=bets,
+    )
+
+def legacy_bets(m, db, market, event_ids):
+    bets = {event_id: [] for event_id in event_ids}
+    if not bets:
+        return bets
+    B, M = market.bet_cls, market.model_cls
+    rows = db.query(B.event_id, M.name, B.side, B.amount, B.profit)\
+             .join(M, B.model_id == M.id)\
+             .filter(B.event_id.in_(list(bets)))\
+             .order_by(B.id).all()
+    for event_id, name, side, amount, profit in rows:
+        bets[event_id].append(m.BetSchema(model_id=name, side=side, amount=amount, profit=profit))
+    return bets
+
+def legacy_loaders(m, market):
+    def models():
+        db = market.SessionLocal()
+        rows = db.query(market.model_cls).all()
+        db.close()
+        return [m.ModelSchema(**row.__dict__) for row in rows]
+
+    def current_event():
+        db = market.SessionLocal()
+        event = db.query(market.event_cls).filter_by(status="active").first()
+        bets = legacy_bets(m, db, market, [event.id]) if event else {}
+        db.close()
+        return legacy_event(market, event, bets[event.id]) if event else None
+
+    def history():
+        E = market.event_cls
+        db = market.SessionLocal()
+        events = db.query(E).order_by(E.id.desc()).limit(50).all()
+        bets = legacy_bets(m, db, market, [e.id for e in events])
+        db.close()
+        return [legacy_event(market, e, bets[e.id]) for e in events]
+
+    return {
+        "models": models,
+        "leaderboard": market.load_leaderboard,
+        "events/current": current_event,
+        "events/history": history,
+    }
+
+def fast_loaders(market):
+    return {
+        "models": market.load_models,
+        "leaderboard": market.load_leaderboard,
+        "events/current": market.load_current_event,
+        "events/history": lambda: market.load_event_history(50),
+    }
+
+def measure(fn, seconds: float):
+    fn()
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=500, help="событий на рынок")
+    parser.add_argument("--seconds", type=float, default=2, help="длительность замера на эндпоинт")
+    args = parser.parse_args()
+
+    # main_gpt создаёт базы в текущем каталоге - бенчмарк работает на временных
+    os.environ.setdefault("LLM_BACKEND", "stub")
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="arena-bench-"))
+    import main_gpt as m
+    m.prepare_databases()
+
+    print(f"{'endpoint':<34}{'legacy req/s':>14}{'fast req/s':>14}{'speedup':>10}")
+    for market in m.MARKETS:
+        seed_market(m, market, args.events)
+        market.leaderboard.ensure_loaded()
+        legacy, fast = legacy_loaders(m, market), fast_loaders(market)
+        for name in fast:
+            before = measure(lambda: legacy_encode(legacy[name]()), args.seconds)
+            after = measure(lambda: m.dump_json(fast[name]()), args.seconds)
+            print(f"{market.prefix + '/' + name:<34}{before:>14.0f}{after:>14.0f}{after / before:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import asyncio, os, socket, sys, time
+
+from sqlalchemy import text
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # нужен только для EVENT_BUS=redis
+    redis = None
+
+# -------------------------
+# Pub/sub bus
+# -------------------------
+class InMemoryBus:
+    """Шина в пределах одного процесса: обработчики вызываются сразу при публикации"""
+    # Другие воркеры сообщений не видят
+    shared = False
+
+    def __init__(self):
+        self.handlers = {}
+        self.published = 0
+        self.errors = 0
+
+    def subscribe(self, channel: str, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, callback):
+        """Соединения нет - терять сообщения нечему"""
+
+    async def publish(self, channel: str, payload: bytes):
+        self.published += 1
+        for handler in self.handlers.get(channel, []):
+            # Как и у RedisBus: сбой обработчика не превращает уже сделанную запись в ошибку публикации
+            try:
+                await handler(payload)
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Event bus handler failed on {channel}: {e}")
+
+    async def start(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def stats(self):
+        return {"backend": "memory", "published": self.published, "errors": self.errors}
+
+# Пауза перед переподключением к Redis: удваивается до максимума, успешная подписка сбрасывает её
+BUS_RETRY_MIN, BUS_RETRY_MAX = 0.5, 30
+
+class RedisBus:
+    """Pub/sub через Redis-совместимый сервер: сообщение получают все воркеры, включая отправителя.
+    Слушатель переподключается сам; сообщения, пропущенные за разрыв, восполняют колбэки on_reconnect"""
+    shared = True
+
+    def __init__(self, url: str):
+        self.url = url
+        self.handlers = {}
+        self.reconnect_callbacks = []
+        self.client = None
+        self.pubsub = None
+        self.task = None
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.connected = False
+
+    def subscribe(self, channel: str, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, callback):
+        """callback() вызывается после каждой повторной подписки"""
+        self.reconnect_callbacks.append(callback)
+
+    async def publish(self, channel: str, payload: bytes):
+        self.published += 1
+        await self.client.publish(channel, payload)
+
+    async def start(self):
+        if redis is None:
+            raise RuntimeError("EVENT_BUS=redis requires the 'redis' package")
+        self.client = redis.from_url(self.url)
+        await self._subscribe()
+        self.task = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        self.pubsub = self.client.pubsub()
+        await self.pubsub.subscribe(*self.handlers)
+        self.connected = True
+
+    async def _unsubscribe(self):
+        self.connected = False
+        pubsub, self.pubsub = self.pubsub, None
+        if pubsub is not None:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    async def _listen(self):
+        retry = BUS_RETRY_MIN
+        while True:
+            try:
+                if self.pubsub is None:
+                    await self._subscribe()
+                    self.reconnects += 1
+                    print("✓ Event bus reconnected")
+                    for callback in self.reconnect_callbacks:
+                        try:
+                            await callback()
+                        except Exception as e:
+                            print(f"❌ Event bus reconnect callback failed: {e}")
+                retry = BUS_RETRY_MIN
+                async for message in self.pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    self.received += 1
+                    channel = message["channel"].decode()
+                    for handler in self.handlers.get(channel, []):
+                        # Ошибка одного обработчика не должна останавливать приём для остальных рынков
+                        try:
+                            await handler(message["data"])
+                        except Exception as e:
+                            self.errors += 1
+                            print(f"❌ Event bus handler failed on {channel}: {e}")
+                raise ConnectionError("subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Event bus connection lost: {e}; reconnecting in {retry}s")
+                await self._unsubscribe()
+                await asyncio.sleep(retry)
+                retry = min(retry * 2, BUS_RETRY_MAX)
+
+    async def aclose(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self._unsubscribe()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def stats(self):
+        return {"backend": "redis", "connected": self.connected, "published": self.published,
+                "received": self.received, "errors": self.errors, "reconnects": self.reconnects}
+
+def configured_workers() -> int:
+    """Число воркеров uvicorn: --workers командной строки (воркеры, запущенные через spawn, видят argv родителя)
+    или WEB_CONCURRENCY, который читают и uvicorn, и __main__"""
+    argv = sys.argv
+    for idx, arg in enumerate(argv):
+        if arg == "--workers" and idx + 1 < len(argv):
+            return int(argv[idx + 1])
+        if arg.startswith("--workers="):
+            return int(arg.split("=", 1)[1])
+    return int(os.getenv("WEB_CONCURRENCY", "1"))
+
+def bus_from_env():
+    if os.getenv("EVENT_BUS", "memory") == "redis":
+        return RedisBus(os.getenv("EVENT_BUS_URL", "redis://localhost:6379/0"))
+    return InMemoryBus()
+
+# -------------------------
+# Leader election
+# -------------------------
+class LocalLease:
+    """Аренда одиночного процесса (шина в памяти, других воркеров нет): лидер всегда этот процесс, БД не трогается.
+    Продление раз в ttl/3 - пустое пробуждение планировщика"""
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:local"
+
+    @property
+    def renew_interval(self):
+        return self.ttl / 3
+
+    async def acquire(self) -> bool:
+        return True
+
+    async def release(self):
+        pass
+
+class SQLiteLease:
+    """Аренда лидерства в общей SQLite-базе: лидер тот, кто продлевает её раньше, чем истечёт ttl"""
+    def __init__(self, engine, name: str, ttl: float = 15):
+        self.engine = engine
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}"
+        self.created = False
+
+    @property
+    def renew_interval(self):
+        return self.ttl / 3
+
+    async def acquire(self) -> bool:
+        """Берёт свободную или истёкшую аренду либо продлевает свою; True - этот процесс лидер"""
+        now = time.time()
+        async with self.engine.begin() as conn:
+            if not self.created:
+                await conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at FLOAT)"
+                ))
+                self.created = True
+            await conn.execute(text("""
+                INSERT INTO leases (name, owner, expires_at) VALUES (:name, :owner, :expires_at)
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < :now
+            """), {"name": self.name, "owner": self.owner, "expires_at": now + self.ttl, "now": now})
+            owner = (await conn.execute(
+                text("SELECT owner FROM leases WHERE name = :name"), {"name": self.name}
+            )).scalar()
+        return owner == self.owner
+
+    async def release(self):
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM leases WHERE name = :name AND owner = :owner"),
+                {"name": self.name, "owner": self.owner},
+            )
@@ -0,0 +1,254 @@
+import asyncio, json, os, random, time
+from collections import OrderedDict
+
+import httpx
+
+from metrics import counter, histogram
+
+LLM_LATENCY = histogram("llm_request_duration_seconds", "LLM backend call latency", ("kind", "outcome"))
+LLM_FIRST_TOKEN = histogram("llm_first_token_seconds", "Time to the first streamed LLM token")
+LLM_CACHE = counter("llm_cache_total", "LLM answer cache lookups", ("result",))
+
+# -------------------------
+# Response cache
+# -------------------------
+class TTLCache:
+    """LRU-кэш с временем жизни записей"""
+    def __init__(self, max_size: int = 1024, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            LLM_CACHE.inc("miss")
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        LLM_CACHE.inc("hit")
+        return entry[1]
+
+    def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+# -------------------------
+# Backends
+# -------------------------
+class OpenAIBackend:
+    """AsyncOpenAI с общим пулом соединений (OPENAI_BASE_URL позволяет указать локальный stub-сервер)"""
+    def __init__(self, model: str, timeout: float, max_connections: int):
+        self.model = model
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.client = None
+
+    def _get_client(self):
+        # Создаём лениво: без OPENAI_API_KEY конструктор падает, а импорт приложения не должен.
+        # Сам пакет openai импортируется почти секунду - платит только процесс, который к нему обращается
+        if self.client is None:
+            import openai
+            self.client = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=self.timeout,
+                http_client=httpx.AsyncClient(limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                )),
+            )
+        return self.client
+
+    async def complete(self, messages, temperature: float, max_tokens: int, json_mode: bool = False) -> str:
+        # JSON-ответ обеспечивает промпт: response_format={"type": "json_object"} поддерживают не все модели (gpt-4 - нет)
+        response = await self._get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return response.choices[0].message.content
+
+    async def stream(self, messages, temperature: float, max_tokens: int):
+        response = await self._get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+class StubBackend:
+    """Локальная заглушка вместо OpenAI для нагрузочных тестов без сети"""
+    def __init__(self, latency: float = 0.5, token_delay: float = 0.02):
+        self.latency = latency
+        self.token_delay = token_delay
+
+    async def complete(self, messages, temperature: float, max_tokens: int, json_mode: bool = False) -> str:
+        await asyncio.sleep(self.latency)
+        question = messages[-1]["content"]
+        if json_mode:
+            return json.dumps({"side": random.choice(["YES", "NO"]), "amount": random.randint(100, 500),
+                               "reasoning": f"[stub] {question}"})
+        return f"[stub] {question}"
+
+    async def stream(self, messages, temperature: float, max_tokens: int):
+        await asyncio.sleep(self.latency)
+        question = messages[-1]["content"]
+        for i, word in enumerate(f"[stub] {question}".split(" ")):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+    async def aclose(self):
+        pass
+
+# -------------------------
+# Gateway
+# -------------------------
+class LLMGateway:
+    """Асинхронный шлюз к LLM: лимит параллельных запросов, таймаут и кэш ответов"""
+    def __init__(self, backend, max_concurrency: int = 8, timeout: float = 30,
+                 cache_size: int = 1024, cache_ttl: float = 600):
+        self.backend = backend
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.in_flight = 0
+
+    @classmethod
+    def from_env(cls):
+        timeout = float(os.getenv("LLM_TIMEOUT", "30"))
+        max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        if os.getenv("LLM_BACKEND", "openai") == "stub":
+            backend = StubBackend(float(os.getenv("LLM_STUB_LATENCY", "0.5")))
+        else:
+            backend = OpenAIBackend(os.getenv("LLM_MODEL", "gpt-4"), timeout, max_concurrency)
+        return cls(
+            backend,
+            max_concurrency=max_concurrency,
+            timeout=timeout,
+            cache_size=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+            cache_ttl=float(os.getenv("LLM_CACHE_TTL", "600")),
+        )
+
+    async def chat(self, persona: str, system_prompt: str, question: str,
+                   temperature: float = 0.8, max_tokens: int = 500) -> str:
+        key = (persona, normalize_question(question))
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": question},
+        ]
+        answer = await self._complete("chat", messages, temperature, max_tokens)
+        self.cache.set(key, answer)
+        return answer
+
+    async def predict(self, system_prompt: str, question: str,
+                      temperature: float = 0.7, max_tokens: int = 150) -> str:
+        """Ответ-решение в JSON для ставки. Без кэша: решение по событию принимается один раз"""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": question},
+        ]
+        return await self._complete("predict", messages, temperature, max_tokens, json_mode=True)
+
+    async def _complete(self, kind: str, messages, temperature: float, max_tokens: int, json_mode: bool = False) -> str:
+        async with self.semaphore:
+            self.in_flight += 1
+            start, outcome = time.perf_counter(), "error"
+            try:
+                answer = await asyncio.wait_for(
+                    self.backend.complete(messages, temperature, max_tokens, json_mode), self.timeout
+                )
+                outcome = "ok"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            except asyncio.CancelledError:
+                # Вызывающий перестал ждать (например, истёк таймаут ставки агента)
+                outcome = "cancelled"
+                raise
+            finally:
+                self.in_flight -= 1
+                LLM_LATENCY.observe(time.perf_counter() - start, kind, outcome)
+        return answer
+
+    async def stream(self, persona: str, system_prompt: str, question: str,
+                     temperature: float = 0.8, max_tokens: int = 500):
+        """Токены по мере генерации; если клиент ушёл, закрытие генератора обрывает запрос к модели"""
+        key = (persona, normalize_question(question))
+        answer = self.cache.get(key)
+        if answer is not None:
+            yield answer
+            return
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": question},
+        ]
+        loop = asyncio.get_running_loop()
+        chunks = []
+        async with self.semaphore:
+            self.in_flight += 1
+            start = loop.time()
+            deadline = start + self.timeout
+            tokens = self.backend.stream(messages, temperature, max_tokens)
+            # Клиент ушёл посреди ответа (GeneratorExit) - тоже "cancelled"
+            outcome = "cancelled"
+            try:
+                while True:
+                    try:
+                        token = await asyncio.wait_for(tokens.__anext__(), deadline - loop.time())
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        outcome = "timeout"
+                        raise
+                    except Exception:
+                        outcome = "error"
+                        raise
+                    if not chunks:
+                        LLM_FIRST_TOKEN.observe(loop.time() - start)
+                    chunks.append(token)
+                    yield token
+                outcome = "ok"
+            finally:
+                self.in_flight -= 1
+                LLM_LATENCY.observe(loop.time() - start, "stream", outcome)
+                await tokens.aclose()
+        self.cache.set(key, "".join(chunks))
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "cache_entries": len(self.cache.entries),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
+
+    async def aclose(self):
+        await self.backend.aclose()
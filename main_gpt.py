@@ -1,42 +1,56 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Response, Query, HTTPException, Header
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime, timedelta
-import enum, random, asyncio, os
+import enum, random, asyncio, os, json, hashlib, threading, heapq, bisect, time, re, math
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-import openai
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Enum
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base, joinedload
-from sqlalchemy import inspect, text
+from llm_gateway import LLMGateway
+from cluster import LocalLease, SQLiteLease, bus_from_env, configured_workers
+from writer import WriteQueue
+from metrics import REGISTRY, MetricsMiddleware, count_queries, counter, histogram, gauge, profiler
+
+from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, DateTime, Enum, Index
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, declared_attr
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import inspect, text, select, update, insert, delete, bindparam
+from sqlalchemy import event as sa_event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocketClose
 import uvicorn
 
+try:
+    import orjson
+except ImportError:  # необязателен: без него ответы кодирует стандартный json
+    orjson = None
+
 # Load environment variables
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# -------------------------
-# Database setup - MAIN MARKETS
-# -------------------------
-DB_FILE = "./arena.db"
-CREATE_DB = not os.path.exists(DB_FILE)
-DATABASE_URL = f"sqlite:///{DB_FILE}"
-
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
 
 # -------------------------
-# Database setup - COMMUNITY MARKETS
+# SQLite tuning profile
 # -------------------------
-COMMUNITY_DB_FILE = "./arena_community.db"
-CREATE_COMMUNITY_DB = not os.path.exists(COMMUNITY_DB_FILE)
-COMMUNITY_DATABASE_URL = f"sqlite:///{COMMUNITY_DB_FILE}"
+# WAL позволяет читать параллельно с записью, busy_timeout ждёт блокировку вместо "database is locked"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": 5000,
+    "synchronous": "NORMAL",
+    "cache_size": -64000,      # 64 МБ page cache на соединение
+    "mmap_size": 268435456,    # 256 МБ
+    "temp_store": "MEMORY",
+}
 
-community_engine = create_engine(COMMUNITY_DATABASE_URL, connect_args={"check_same_thread": False})
-CommunitySessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=community_engine)
-CommunityBase = declarative_base()
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
 
 # -------------------------
 # Enums
@@ -45,10 +59,16 @@ class SideEnum(str, enum.Enum):
     YES = "YES"
     NO = "NO"
 
+class PerformanceWindow(str, enum.Enum):
+    HOUR = "1h"
+    DAY = "24h"
+    WEEK = "7d"
+    ALL = "all"
+
 # -------------------------
-# Main Markets Models
+# Tables (common to every market)
 # -------------------------
-class Model(Base):
+class ModelMixin:
     __tablename__ = "models"
     id = Column(String, primary_key=True)
     name = Column(String, unique=True)
@@ -58,75 +78,122 @@ class Model(Base):
     biggest_win = Column(Float, default=0)
     biggest_loss = Column(Float, default=0)
 
-class Event(Base):
+class EventMixin:
     __tablename__ = "events"
     id = Column(Integer, primary_key=True, autoincrement=True)
     description = Column(String)
-    market_link = Column(String, nullable=True)
     start_time = Column(DateTime, default=datetime.utcnow)
     end_time = Column(DateTime)
-    status = Column(String, default="upcoming")
+    status = Column(String, default="upcoming", index=True)
     result = Column(Enum(SideEnum), nullable=True)
     start_in_seconds = Column(Integer, default=0)
     duration_minutes = Column(Integer, default=10)
-    bets = relationship("Bet", back_populates="event")
+    total_yes = Column(Float, default=0)
+    total_no = Column(Float, default=0)
+    bets_count = Column(Integer, default=0)
+    archived_at = Column(DateTime, nullable=True)
 
-class Bet(Base):
+class BetMixin:
     __tablename__ = "bets"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    model_id = Column(String, ForeignKey("models.id"))
-    event_id = Column(Integer, ForeignKey("events.id"))
     side = Column(Enum(SideEnum))
     amount = Column(Float)
     profit = Column(Float, nullable=True)
+
+    @declared_attr
+    def model_id(cls):
+        return Column(String, ForeignKey("models.id"))
+
+    @declared_attr
+    def event_id(cls):
+        return Column(Integer, ForeignKey("events.id"), index=True)
+
+class BalanceSnapshotMixin:
+    """Append-only история баланса модели: одна строка на модель на каждый расчёт"""
+    __tablename__ = "balance_history"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_id = Column(Integer)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    balance = Column(Float)
+    profit = Column(Float)
+    wins = Column(Integer)
+    total_bets = Column(Integer)
+
+    @declared_attr
+    def model_id(cls):
+        return Column(String, ForeignKey("models.id"))
+
+    @declared_attr.directive
+    def __table_args__(cls):
+        return (Index("ix_balance_history_model_time", "model_id", "timestamp"),)
+
+class IdempotencyKeyMixin:
+    """Ответ на PATCH с заголовком Idempotency-Key: повтор с тем же ключом получает тот же ответ"""
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    event_id = Column(Integer)
+    result = Column(Enum(SideEnum), nullable=True)
+    status_code = Column(Integer)
+    response = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# -------------------------
+# Main Markets Models
+# -------------------------
+Base = declarative_base()
+
+class Model(ModelMixin, Base):
+    pass
+
+class Event(EventMixin, Base):
+    market_link = Column(String, nullable=True)
+    bets = relationship("Bet", back_populates="event")
+
+class Bet(BetMixin, Base):
     model = relationship("Model")
     event = relationship("Event", back_populates="bets")
 
+class BalanceSnapshot(BalanceSnapshotMixin, Base):
+    pass
+
+class IdempotencyKey(IdempotencyKeyMixin, Base):
+    pass
+
 # -------------------------
 # Community Markets Models
 # -------------------------
-class CommunityModel(CommunityBase):
-    __tablename__ = "models"
-    id = Column(String, primary_key=True)
-    name = Column(String, unique=True)
-    balance = Column(Float, default=10000)
-    wins = Column(Integer, default=0)
-    total_bets = Column(Integer, default=0)
-    biggest_win = Column(Float, default=0)
-    biggest_loss = Column(Float, default=0)
+CommunityBase = declarative_base()
 
-class CommunityEvent(CommunityBase):
-    __tablename__ = "events"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    description = Column(String)
+class CommunityModel(ModelMixin, CommunityBase):
+    pass
+
+class CommunityEvent(EventMixin, CommunityBase):
     username = Column(String)
     twitter_link = Column(String)
     avatar_url = Column(String, default="img/avatarr.webp")
-    start_time = Column(DateTime, default=datetime.utcnow)
-    end_time = Column(DateTime)
-    status = Column(String, default="upcoming")
-    result = Column(Enum(SideEnum), nullable=True)
-    start_in_seconds = Column(Integer, default=0)
-    duration_minutes = Column(Integer, default=10)
     bets = relationship("CommunityBet", back_populates="event")
 
-class CommunityBet(CommunityBase):
-    __tablename__ = "bets"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    model_id = Column(String, ForeignKey("models.id"))
-    event_id = Column(Integer, ForeignKey("events.id"))
-    side = Column(Enum(SideEnum))
-    amount = Column(Float)
-    profit = Column(Float, nullable=True)
+class CommunityBet(BetMixin, CommunityBase):
     model = relationship("CommunityModel")
     event = relationship("CommunityEvent", back_populates="bets")
 
-# Create tables
-if CREATE_DB:
-    Base.metadata.create_all(bind=engine)
+class CommunityBalanceSnapshot(BalanceSnapshotMixin, CommunityBase):
+    pass
 
-if CREATE_COMMUNITY_DB:
-    CommunityBase.metadata.create_all(bind=community_engine)
+class CommunityIdempotencyKey(IdempotencyKeyMixin, CommunityBase):
+    pass
+
+# -------------------------
+# Archive (bets of old finished events, one file per market)
+# -------------------------
+ArchiveBase = declarative_base()
+
+class ArchivedBets(ArchiveBase):
+    """Ставки события одной строкой JSON: [{"model_id", "side", "amount", "profit"}, ...] в порядке ставок"""
+    __tablename__ = "archived_bets"
+    event_id = Column(Integer, primary_key=True)
+    archived_at = Column(DateTime)
+    bets = Column(String)
 
 # -------------------------
 # Pydantic Schemas
@@ -148,6 +215,7 @@ class EventSchema(BaseModel):
     bets: List[BetSchema] = []
     total_yes: Optional[float] = 0
     total_no: Optional[float] = 0
+    bets_count: Optional[int] = 0
 
 class CommunityEventSchema(BaseModel):
     id: int
@@ -162,6 +230,7 @@ class CommunityEventSchema(BaseModel):
     bets: List[BetSchema] = []
     total_yes: Optional[float] = 0
     total_no: Optional[float] = 0
+    bets_count: Optional[int] = 0
 
 class ModelSchema(BaseModel):
     id: str
@@ -181,6 +250,22 @@ class LeaderboardSchema(BaseModel):
     biggest_win: float
     biggest_loss: float
 
+class PerformancePoint(BaseModel):
+    timestamp: datetime
+    balance: float
+
+class PerformanceSchema(BaseModel):
+    model_id: str
+    window: PerformanceWindow
+    resolution: int
+    start_balance: float
+    end_balance: float
+    return_percent: float
+    max_drawdown: float
+    win_rate: float
+    bets: int
+    points: List[PerformancePoint] = []
+
 class BubbleMapItem(BaseModel):
     model: str
     balance: float
@@ -203,6 +288,16 @@ class CommunityEventCreateSchema(BaseModel):
 class EventResultSchema(BaseModel):
     result: SideEnum
 
+# Верхняя граница пачки: вся пачка держит блокировку записи SQLite одной транзакцией
+BULK_SETTLE_MAX_EVENTS = 500
+
+class EventResultItem(BaseModel):
+    event_id: int
+    result: SideEnum
+
+class BulkEventResultSchema(BaseModel):
+    results: List[EventResultItem] = Field(min_length=1, max_length=BULK_SETTLE_MAX_EVENTS)
+
 class ChatRequest(BaseModel):
     model_id: str
     question: str
@@ -210,34 +305,250 @@ class ChatRequest(BaseModel):
 # -------------------------
 # FastAPI app
 # -------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+class Readiness:
+    """Фаза старта процесса: импорт ничего не делает с базами, подготовка идёт фоном после запуска сервера"""
+    def __init__(self):
+        self.status = "starting"
+        self.error = None
+        self.startup_seconds = None
+        self.task = None
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def report(self):
+        return {"status": self.status, "startup_seconds": self.startup_seconds, "error": self.error}
+
+readiness = Readiness()
+
+# Отвечают и во время старта: liveness/readiness-пробы и scrape метрик
+READINESS_EXEMPT = ("/health", "/ready", "/metrics")
+
+class ReadinessGate:
+    """ASGI-middleware: пока базы не подготовлены, HTTP получает 503 с Retry-After, WebSocket - закрытие 1013"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if readiness.ready or scope["type"] not in ("http", "websocket") or scope["path"] in READINESS_EXEMPT:
+            await self.app(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await WebSocketClose(code=1013)(scope, receive, send)
+        else:
+            response = JSONResponse({"detail": "Service is starting"}, status_code=503, headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ReadinessGate)
+app.add_middleware(MetricsMiddleware)
+
+# -------------------------
+# Metrics (hot paths; HTTP and SQL are counted by MetricsMiddleware)
+# -------------------------
+SETTLE_LATENCY = histogram("settlement_duration_seconds", "Time spent settling one event", ("market",))
+BETS_LATENCY = histogram("bets_generation_duration_seconds", "Time spent placing bets for activated events", ("market",))
+SCHEDULER_TICK = histogram("scheduler_tick_duration_seconds", "Scheduler tick: activating and closing due events")
+BROADCAST_LATENCY = histogram("ws_broadcast_duration_seconds", "WebSocket fan-out of one message", ("channel",))
+ARCHIVE_LATENCY = histogram("archive_batch_duration_seconds", "Moving one batch of finished events to the archive", ("market",))
+ARCHIVED_EVENTS = counter("archived_events_total", "Finished events whose bets were moved to the archive", ("market",))
 
 # -------------------------
 # WebSocket manager
 # -------------------------
+CLIENT_QUEUE_SIZE = 32
+CLIENT_SEND_TIMEOUT = 5
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    """Рассылка через очередь на каждого клиента: медленный или мёртвый сокет не тормозит остальных.
+    Переполненная очередь теряет самое старое сообщение, а при close_slow сокет закрывается целиком -
+    для каналов, где пропуск недопустим и клиент умеет докачать пропущенное после переподключения"""
+    def __init__(self, name: str = "", queue_size: int = CLIENT_QUEUE_SIZE, send_timeout: float = CLIENT_SEND_TIMEOUT,
+                 close_slow: bool = False):
+        self.name = name
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.close_slow = close_slow
+        self.active_connections = {}
+        self.dropped_messages = 0
+        self.pruned_connections = 0
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        task = asyncio.create_task(self._sender(websocket, queue))
+        self.active_connections[websocket] = (queue, task)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client and client[1] is not asyncio.current_task():
+            client[1].cancel()
+
+    def send(self, websocket: WebSocket, data):
+        """Ставит сообщение в очередь одного клиента (в порядке с остальными рассылками)"""
+        client = self.active_connections.get(websocket)
+        if client:
+            self._enqueue(websocket, client[0], encode_message(data))
 
     async def broadcast(self, data):
-        for connection in self.active_connections:
-            await connection.send_json(data)
+        with BROADCAST_LATENCY.time(self.name):
+            text = encode_message(data)
+            for websocket, (queue, _) in list(self.active_connections.items()):
+                self._enqueue(websocket, queue, text)
+
+    def stats(self):
+        return {
+            "clients": len(self.active_connections),
+            "queue_depth": sum(q.qsize() for q, _ in self.active_connections.values()),
+            "dropped_messages": self.dropped_messages,
+            "pruned_connections": self.pruned_connections,
+        }
+
+    def _enqueue(self, websocket: WebSocket, queue: asyncio.Queue, text: str):
+        if queue.full():
+            if self.close_slow:
+                # Дыра в нумерации хуже разрыва: клиент переподключится с since= и получит пропущенное или снимок
+                self.pruned_connections += 1
+                self.disconnect(websocket)
+                asyncio.create_task(self._close(websocket))
+                return
+            # Клиент не успевает - выбрасываем самое старое сообщение, оставляя свежие
+            queue.get_nowait()
+            self.dropped_messages += 1
+        queue.put_nowait(text)
+
+    def close_all(self, code: int):
+        """Закрывает всех клиентов канала; они переподключатся сами"""
+        for websocket in list(self.active_connections):
+            self.disconnect(websocket)
+            asyncio.create_task(self._close(websocket, code))
+
+    async def _close(self, websocket: WebSocket, code: int = 1013):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _sender(self, websocket: WebSocket, queue: asyncio.Queue):
+        try:
+            while True:
+                text = await queue.get()
+                await asyncio.wait_for(websocket.send_text(text), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.pruned_connections += 1
+            self.disconnect(websocket)
+
+def encode_message(data) -> str:
+    return dump_json(data).decode("utf-8")
+
+def dump_json(data) -> bytes:
+    """dict/list/datetime/enum orjson кодирует сам, остальное (pydantic-модели) - через jsonable_encoder"""
+    if orjson is not None:
+        return orjson.dumps(data, default=jsonable_encoder)
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
-manager = ConnectionManager()
-community_manager = ConnectionManager()
+# -------------------------
+# Response cache
+# -------------------------
+# Ключи включают параметры клиента (before_id, offset, model_id...), поэтому число записей ограничено
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+
+class ResponseCache:
+    """LRU-кэш готовых JSON-ответов рынка; сбрасывается при каждой записи"""
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.version = 0
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        # Без блокировки: вызывается из event loop и не должен ждать потока, читающего БД
+        self.version += 1
+        self.entries = OrderedDict()
+
+    def get(self, key, loader):
+        entries = self.entries
+        entry = entries.get(key)
+        if entry is not None:
+            try:
+                entries.move_to_end(key)
+            except KeyError:  # запись успели вытеснить из другого потока
+                pass
+            return entry
+        # Один запрос к БД на ключ, даже если промах пришёл из нескольких потоков сразу
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                version = self.version
+                body = dump_json(loader())
+                entry = (body, f'"{hashlib.sha1(body).hexdigest()}"')
+                # Если во время чтения была запись, результат не кэшируем
+                if version == self.version:
+                    self.entries[key] = entry
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+        return entry
+
+cache = ResponseCache()
+community_cache = ResponseCache()
+
+# Готовый Response обходит повторную валидацию по response_model: он остаётся только для OpenAPI
+def cached_response(request: Request, response_cache: ResponseCache, key, loader):
+    body, etag = response_cache.get(key, loader)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def cached_payload(response_cache: ResponseCache, key, loader):
+    return json.loads(response_cache.get(key, loader)[0])
+
+# -------------------------
+# Live feed (one multiplexed channel per market)
+# -------------------------
+FEED_BACKLOG = 1000
+
+class MarketFeed:
+    """Нумерованные сообщения рынка с буфером для докачки после переподключения"""
+    def __init__(self, connections: ConnectionManager, backlog: int = FEED_BACKLOG):
+        self.connections = connections
+        self.epoch = os.urandom(4).hex()
+        self.seq = 0
+        self.backlog = deque(maxlen=backlog)
+
+    async def publish(self, type: str, data):
+        self.seq += 1
+        message = {"seq": self.seq, "epoch": self.epoch, "type": type, "data": data}
+        self.backlog.append(message)
+        await self.connections.broadcast(message)
+
+    def reset(self):
+        """Новая эпоха: сообщения могли потеряться, поэтому клиенты переподключаются и получают снимок"""
+        self.epoch = os.urandom(4).hex()
+        self.backlog.clear()
+        self.connections.close_all(1012)
+
+    def replay(self, since: int, epoch: Optional[str]):
+        """Пропущенные сообщения после since или None, если нужен полный снимок"""
+        if epoch != self.epoch or since > self.seq:
+            return None
+        if since < self.seq and (not self.backlog or self.backlog[0]["seq"] > since + 1):
+            return None
+        return [m for m in self.backlog if m["seq"] > since]
 
 # -------------------------
 # Model Prompts
@@ -309,389 +620,1284 @@ You are a highly efficient and intelligent betting AI. When making predictions o
 
 Your personality: Efficient, decisive, results-oriented. You maximize value in every prediction.""" 
 }
+llm = LLMGateway.from_env()
+
+# -------------------------
+# AI agents (bets from model personas)
+# -------------------------
+BET_MIN, BET_MAX = 100, 500
+# AGENT_BETS=random - прежние случайные ставки без обращений к LLM
+AGENT_BETS = os.getenv("AGENT_BETS", "llm")
+AGENT_BET_TIMEOUT = float(os.getenv("AGENT_BET_TIMEOUT", "15"))
+AGENT_BET_INSTRUCTIONS = f"""
+
+You are now placing a real bet in the AI prediction arena.
+Respond ONLY with a JSON object: {{"side": "YES" or "NO", "amount": integer from {BET_MIN} to {BET_MAX}, "reasoning": "one short sentence"}}.
+Stake more when you are more confident."""
+
+AGENT_BETS_TOTAL = counter("agent_bets_total", "Bets decided for model agents by source", ("source",))
+
+def random_bet():
+    return random.choice([SideEnum.YES, SideEnum.NO]), random.randint(BET_MIN, BET_MAX)
+
+def parse_bet(answer: str):
+    """JSON-ответ модели -> (side, amount) или None; сумма приводится к [BET_MIN, BET_MAX]"""
+    match = re.search(r"\{.*\}", answer or "", re.S)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+        side = SideEnum(str(data["side"]).strip().upper())
+        amount = float(data["amount"])
+    except (ValueError, TypeError, KeyError):
+        return None
+    # 1e999, "Infinity" и "NaN" - не ставка: int() от них падает с OverflowError/ValueError
+    if not math.isfinite(amount):
+        return None
+    return side, min(max(int(amount), BET_MIN), BET_MAX)
+
+async def agent_bet(model_id: str, event):
+    """Решение одной персоны по событию: ((side, amount), источник). Любой сбой - случайная ставка"""
+    if AGENT_BETS != "llm" or model_id not in MODEL_PROMPTS:
+        return random_bet(), "random"
+    question = f"Prediction market event: {event['description']}\nWill it resolve YES or NO, and how much do you stake?"
+    try:
+        # Таймаут покрывает и ожидание в очереди LLMGateway, чтобы ставки не висели за чатом
+        answer = await asyncio.wait_for(llm.predict(MODEL_PROMPTS[model_id] + AGENT_BET_INSTRUCTIONS, question),
+                                        AGENT_BET_TIMEOUT)
+        bet = parse_bet(answer)
+    except asyncio.TimeoutError:
+        return random_bet(), "timeout"
+    except Exception as e:
+        print(f"❌ Agent {model_id} failed: {e}")
+        return random_bet(), "error"
+    return (bet, "llm") if bet else (random_bet(), "unparsed")
+
+async def agent_bets(model_ids, events):
+    """Все персоны по всем событиям одновременно (параллельность ограничивает LLMGateway):
+    активация N моделей стоит примерно одного запроса к LLM. Возвращает {event_id: {model_id: (side, amount)}}.
+    Сбой одного агента заменяется случайной ставкой только для него"""
+    keys = [(event["id"], model_id) for event in events for model_id in model_ids]
+    results = await asyncio.gather(*(agent_bet(model_id, event) for event in events for model_id in model_ids),
+                                   return_exceptions=True)
+    decisions = {}
+    for (event_id, model_id), result in zip(keys, results):
+        if isinstance(result, BaseException):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            print(f"❌ Agent {model_id} failed: {result}")
+            result = random_bet(), "error"
+        bet, source = result
+        AGENT_BETS_TOTAL.inc(source)
+        decisions.setdefault(event_id, {})[model_id] = bet
+    return decisions
+
 # -------------------------
 # Initialize models
 # -------------------------
 MODEL_NAMES = ["GPT", "Claude", "Gemini Pro", "Grok", "DeepSeek", "Qwen Max"]
 
-def migrate_database():
-    """Миграция базы данных без потери данных"""
-    inspector = inspect(engine)
-    
-    # Проверяем существование таблицы events
-    if 'events' in inspector.get_table_names():
-        columns = [col['name'] for col in inspector.get_columns('events')]
-        
-        # Добавляем market_link если его нет
-        if 'market_link' not in columns:
-            print("🔄 Migrating: Adding market_link column to events table...")
-            with engine.connect() as conn:
-                conn.execute(text('ALTER TABLE events ADD COLUMN market_link TEXT'))
-                conn.commit()
-            print("✅ Migration completed successfully!")
-        else:
-            print("✓ market_link column already exists")
-    else:
-        print("✓ Events table doesn't exist yet")
-
-# Всегда создаём таблицы (create_all безопасна - не перезаписывает существующие)
-Base.metadata.create_all(bind=engine)
-
-# Запускаем миграцию (она сама проверит нужно ли что-то делать)
-migrate_database()
-
-# Initialize Main Markets models
-db = SessionLocal()
-for name in MODEL_NAMES:
-    if not db.query(Model).filter_by(name=name).first():
-        db.add(Model(id=name.lower().replace(" ", "_"), name=name))
-db.commit()
-db.close()
-
-# Initialize Community Markets models
-community_db = CommunitySessionLocal()
-for name in MODEL_NAMES:
-    if not community_db.query(CommunityModel).filter_by(name=name).first():
-        community_db.add(CommunityModel(id=name.lower().replace(" ", "_"), name=name))
-community_db.commit()
-community_db.close()
-
-# -------------------------
-# Helper functions - Main Markets
-# -------------------------
-async def generate_bets(event: Event):
-    db = SessionLocal()
-    models = db.query(Model).all()
-    for model in models:
-        side = random.choice([SideEnum.YES, SideEnum.NO])
-        amount = random.randint(100, 500)
-        bet = Bet(model_id=model.id, event_id=event.id, side=side, amount=amount)
-        db.add(bet)
-        model.total_bets += 1
-    db.commit()
-    db.close()
-
-async def calculate_results(event_id: int, result: SideEnum):
-    db = SessionLocal()
-    event = db.query(Event).filter_by(id=event_id).first()
-    if not event:
-        db.close()
+# -------------------------
+# Migrations
+# -------------------------
+# Версия схемы хранится в PRAGMA user_version каждой базы. Новая миграция - ещё одна пара (версия, fn(conn))
+# в конце списка; fn работает внутри общей транзакции и не делает commit
+def apply_migrations(engine, migrations) -> bool:
+    """Доводит базу до последней версии. Актуальная схема - одно чтение PRAGMA без блокировок;
+    иначе BEGIN IMMEDIATE: воркеры, стартующие одновременно, мигрируют по очереди, и второй видит готовую схему.
+    Возвращает True, если что-то применялось"""
+    target = migrations[-1][0]
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA user_version").scalar() >= target:
+            return False
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for step, migrate in migrations:
+            if version < step:
+                migrate(conn)
+        conn.exec_driver_sql(f"PRAGMA user_version = {max(version, target)}")
+        conn.commit()
+    return version < target
+
+EVENT_TOTALS_COLUMNS = ("total_yes", "total_no", "bets_count")
+
+def migrate_event_columns(conn, event_cls):
+    """Добавляет в events недостающие колонки модели рынка; накопленные суммы заполняет из существующих ставок"""
+    columns = [col['name'] for col in inspect(conn).get_columns('events')]
+    missing = [column for column in event_cls.__table__.columns if column.name not in columns]
+    if not missing:
+        print(f"✓ events columns already exist ({conn.engine.url.database})")
         return
-    event.result = result
-    event.status = "finished"
-    db.commit()
 
-    bets = db.query(Bet).filter(Bet.event_id==event.id).all()
-    winners = [b for b in bets if b.side==result]
-    losers = [b for b in bets if b.side!=result]
-
-    losers_pool = sum(b.amount for b in losers)
-    winners_pool = sum(b.amount for b in winners) or 1
+    print(f"🔄 Migrating: Adding {', '.join(c.name for c in missing)} to events table...")
+    for column in missing:
+        ddl = f'ALTER TABLE events ADD COLUMN {column.name} {column.type.compile(conn.dialect)}'
+        if column.default is not None and column.default.is_scalar:
+            ddl += f' DEFAULT {column.default.arg!r}'
+        conn.execute(text(ddl))
+    if any(column.name in EVENT_TOTALS_COLUMNS for column in missing):
+        conn.execute(text("""
+            UPDATE events SET
+                total_yes = COALESCE((SELECT SUM(amount) FROM bets WHERE bets.event_id = events.id AND bets.side = 'YES'), 0),
+                total_no = COALESCE((SELECT SUM(amount) FROM bets WHERE bets.event_id = events.id AND bets.side = 'NO'), 0),
+                bets_count = (SELECT COUNT(*) FROM bets WHERE bets.event_id = events.id)
+        """))
+    print("✅ Migration completed successfully!")
+
+# create_all не добавляет индексы к уже существующим таблицам
+INDEXES = {
+    "ix_bets_event_id": "bets (event_id)",
+    "ix_events_status": "events (status)",
+    # Частичный индекс: в нём только рассчитанные (result задан), но ещё не архивные события - он не растёт со временем
+    "ix_events_unarchived": "events (end_time) WHERE result IS NOT NULL AND archived_at IS NULL",
+}
 
-    deltas = {}
+def migrate_indexes(conn):
+    """Создаёт недостающие индексы для горячих фильтров (Bet.event_id, Event.status, кандидаты в архив)"""
+    for name, target in INDEXES.items():
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {target}'))
+
+def market_migrations(market):
+    """Версия 1 - схема на момент перехода на user_version: новые таблицы, недостающие колонки events
+    и индексы. Базы любого более старого вида доводятся до неё одним шагом"""
+    def schema_v1(conn):
+        market.tables.base.metadata.create_all(bind=conn)
+        migrate_event_columns(conn, market.event_cls)
+        migrate_indexes(conn)
+
+    def idempotency_key_result_v2(conn):
+        # Ключ привязан и к result запроса: повтор с другим исходом получает 422, а не чужой ответ
+        columns = [col["name"] for col in inspect(conn).get_columns("idempotency_keys")]
+        if "result" not in columns:
+            column = market.tables.key_cls.__table__.c.result
+            conn.execute(text(f"ALTER TABLE idempotency_keys ADD COLUMN result {column.type.compile(conn.dialect)}"))
+    return [(1, schema_v1), (2, idempotency_key_result_v2)]
+
+ARCHIVE_MIGRATIONS = [(1, lambda conn: ArchiveBase.metadata.create_all(bind=conn))]
 
-    for bet in winners:
-        profit = (bet.amount / winners_pool) * losers_pool
-        bet.profit = profit
-        model = db.query(Model).filter_by(id=bet.model_id).first()
-        model.balance += profit 
-        model.wins += 1
-        model.biggest_win = max(model.biggest_win, profit)
-        deltas[model.id] = profit
-
-    for bet in losers:
-        bet.profit = -bet.amount
-        model = db.query(Model).filter_by(id=bet.model_id).first()
-        model.balance -= bet.amount
-        model.biggest_loss = min(model.biggest_loss, -bet.amount)
-        deltas[model.id] = -bet.amount
-
-    db.commit()
-
-    items = [{"model": db.query(Model).filter_by(id=k).first().name, 
-              "balance": db.query(Model).filter_by(id=k).first().balance, 
-              "delta": v} for k,v in deltas.items()]
-    await manager.broadcast({"type": "bubble_map", "data": items})
-    db.close()
-
-# -------------------------
-# Helper functions - Community Markets
-# -------------------------
-async def generate_community_bets(event: CommunityEvent):
-    db = CommunitySessionLocal()
-    models = db.query(CommunityModel).all()
-    for model in models:
-        side = random.choice([SideEnum.YES, SideEnum.NO])
-        amount = random.randint(100, 500)
-        bet = CommunityBet(model_id=model.id, event_id=event.id, side=side, amount=amount)
-        db.add(bet)
-        model.total_bets += 1
-    db.commit()
-    db.close()
-
-async def calculate_community_results(event_id: int, result: SideEnum):
-    db = CommunitySessionLocal()
-    event = db.query(CommunityEvent).filter_by(id=event_id).first()
-    if not event:
-        db.close()
-        return
-    event.result = result
-    event.status = "finished"
-    db.commit()
+# -------------------------
+# Settlement engine (shared by all markets)
+# -------------------------
+MODEL_FIELDS = ("id", "name", "balance", "wins", "total_bets", "biggest_win", "biggest_loss")
 
-    bets = db.query(CommunityBet).filter(CommunityBet.event_id==event.id).all()
-    winners = [b for b in bets if b.side==result]
-    losers = [b for b in bets if b.side!=result]
+def model_row(model):
+    return {
+        "id": model.id,
+        "name": model.name,
+        "balance": model.balance,
+        "wins": model.wins,
+        "total_bets": model.total_bets,
+        "biggest_win": model.biggest_win,
+        "biggest_loss": model.biggest_loss,
+    }
 
-    losers_pool = sum(b.amount for b in losers)
-    winners_pool = sum(b.amount for b in winners) or 1
+# Рассчитать можно идущее или закрытое по времени событие; upcoming ещё без ставок
+SETTLEABLE_STATUSES = ("active", "closed")
+
+class SettleOutcome(str, enum.Enum):
+    SETTLED = "settled"
+    ALREADY_SETTLED = "already_settled"
+    CONFLICT = "conflict"
+    NOT_FOUND = "not_found"
+    NOT_STARTED = "not_started"
+
+def settle_event(db, event_cls, bet_cls, model_cls, history_cls, event_id: int, result: SideEnum):
+    """Расчёт события без commit (его делает вызывающий): первым оператором транзакции идёт условный
+    UPDATE статуса, поэтому повтор или параллельный воркер ничего не выплатит второй раз.
+    Возвращает (SettleOutcome, bubble_map, состояние затронутых моделей)"""
+    E = event_cls
+    claimed = db.execute(
+        update(E).where(E.id == event_id, E.status.in_(SETTLEABLE_STATUSES))
+        .values(status="finished", result=result)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        row = db.execute(select(E.status, E.result).where(E.id == event_id)).first()
+        if row is None:
+            return SettleOutcome.NOT_FOUND, [], []
+        if row.status != "finished":
+            return SettleOutcome.NOT_STARTED, [], []
+        return (SettleOutcome.ALREADY_SETTLED if row.result == result else SettleOutcome.CONFLICT), [], []
+
+    rows = db.query(bet_cls, model_cls)\
+             .join(model_cls, bet_cls.model_id == model_cls.id)\
+             .filter(bet_cls.event_id == event_id).all()
+
+    losers_pool = sum(b.amount for b, _ in rows if b.side != result)
+    winners_pool = sum(b.amount for b, _ in rows if b.side == result) or 1
 
     deltas = {}
-
-    for bet in winners:
-        profit = (bet.amount / winners_pool) * losers_pool
+    for bet, model in rows:
+        if bet.side == result:
+            profit = (bet.amount / winners_pool) * losers_pool
+            model.wins += 1
+            model.biggest_win = max(model.biggest_win, profit)
+        else:
+            profit = -bet.amount
+            model.biggest_loss = min(model.biggest_loss, profit)
         bet.profit = profit
-        model = db.query(CommunityModel).filter_by(id=bet.model_id).first()
-        model.balance += profit 
-        model.wins += 1
-        model.biggest_win = max(model.biggest_win, profit)
-        deltas[model.id] = profit
-
-    for bet in losers:
-        bet.profit = -bet.amount
-        model = db.query(CommunityModel).filter_by(id=bet.model_id).first()
-        model.balance -= bet.amount
-        model.biggest_loss = min(model.biggest_loss, -bet.amount)
-        deltas[model.id] = -bet.amount
-
-    db.commit()
-
-    items = [{"model": db.query(CommunityModel).filter_by(id=k).first().name, 
-              "balance": db.query(CommunityModel).filter_by(id=k).first().balance, 
-              "delta": v} for k,v in deltas.items()]
-    await community_manager.broadcast({"type": "bubble_map", "data": items})
-    db.close()
-
-# -------------------------
-# Endpoints - Main Markets
-# -------------------------
-@app.get("/models", response_model=List[ModelSchema])
-def get_models():
-    db = SessionLocal()
-    models = db.query(Model).all()
-    db.close()
-    return [ModelSchema(**m.__dict__) for m in models]
-
-@app.get("/events/current", response_model=Optional[EventSchema])
-def get_current_event():
-    db = SessionLocal()
-    event = db.query(Event).options(joinedload(Event.bets).joinedload(Bet.model)).filter_by(status="active").first()
-    db.close()
-    if event:
-        total_yes = sum(b.amount for b in event.bets if b.side==SideEnum.YES)
-        total_no = sum(b.amount for b in event.bets if b.side==SideEnum.NO)
-        return EventSchema(
-            id=event.id,
-            description=event.description,
-            market_link=event.market_link,
-            start_time=event.start_time,
-            end_time=event.end_time,
-            status=event.status,
-            result=event.result,
-            total_yes=total_yes,
-            total_no=total_no,
-            bets=[BetSchema(model_id=b.model.name, side=b.side, amount=b.amount, profit=b.profit) for b in event.bets]
-        )
-    return None
-
-@app.get("/events/history", response_model=List[EventSchema])
-def get_event_history(limit: int = 50):
-    db = SessionLocal()
-    events = db.query(Event).options(joinedload(Event.bets).joinedload(Bet.model))\
-               .order_by(Event.id.desc()).limit(limit).all()
-    db.close()
-    result = []
-    for e in events:
-        total_yes = sum(b.amount for b in e.bets if b.side==SideEnum.YES)
-        total_no = sum(b.amount for b in e.bets if b.side==SideEnum.NO)
-        result.append(EventSchema(
-            id=e.id,
-            description=e.description,
-            market_link=e.market_link,  
-            start_time=e.start_time,
-            end_time=e.end_time,
-            status=e.status,
-            result=e.result,
-            total_yes=total_yes,
-            total_no=total_no,
-            bets=[BetSchema(model_id=b.model.name, side=b.side, amount=b.amount, profit=b.profit) for b in e.bets]
-        ))
-    return result
-
-@app.get("/leaderboard", response_model=List[LeaderboardSchema])
-def get_leaderboard():
-    db = SessionLocal()
-    models = db.query(Model).all()
-    db.close()
-    data = []
-    for m in models:
-        win_rate = (m.wins / m.total_bets * 100) if m.total_bets > 0 else 0
-        data.append({
-            "model": m.name,
-            "return_percent": ((m.balance - 10000) / 10000) * 100, 
-            "total_pnl": m.balance - 10000,                        
-            "win_rate": win_rate,
-            "biggest_win": m.biggest_win,
-            "biggest_loss": m.biggest_loss
-        })
-
-    data.sort(key=lambda x: (-x["return_percent"], -x["win_rate"]))
-    for idx, d in enumerate(data):
-        d["rank"] = idx + 1
-    return data
-
-@app.post("/events")
-def add_event(event_data: EventCreateSchema):
-    db = SessionLocal()
-    event = Event(
-        description=event_data.description,
-        market_link=event_data.market_link,
-        start_time=datetime.utcnow(),
-        end_time=datetime.utcnow() + timedelta(minutes=event_data.duration_minutes),
-        start_in_seconds=event_data.start_in_seconds,
-        duration_minutes=event_data.duration_minutes
+        model.balance += profit
+        deltas[model] = deltas.get(model, 0) + profit
+
+    db.execute(update(E).where(E.id == event_id).values(
+        total_yes=sum(b.amount for b, _ in rows if b.side == SideEnum.YES),
+        total_no=sum(b.amount for b, _ in rows if b.side == SideEnum.NO),
+        bets_count=len(rows),
+    ).execution_options(synchronize_session=False))
+
+    # Собираем bubble_map до commit, иначе expire_on_commit перечитает каждую модель
+    items = [{"model": m.name, "balance": m.balance, "delta": d} for m, d in deltas.items()]
+    touched = [model_row(m) for m in deltas]
+    if deltas:
+        now = datetime.utcnow()
+        db.execute(insert(history_cls), [{
+            "model_id": m.id,
+            "event_id": event_id,
+            "timestamp": now,
+            "balance": m.balance,
+            "profit": d,
+            "wins": m.wins,
+            "total_bets": m.total_bets,
+        } for m, d in deltas.items()])
+    return SettleOutcome.SETTLED, items, touched
+
+def coalesce_bubble_map(settled):
+    """Один bubble_map на пачку расчётов: дельты модели суммируются, баланс - после последнего события"""
+    merged = {}
+    for event in settled:
+        for item in event["bubble_map"]:
+            previous = merged.get(item["model"])
+            merged[item["model"]] = dict(item, delta=item["delta"] + (previous["delta"] if previous else 0))
+    return list(merged.values())
+
+def event_totals_update(event_cls):
+    """UPDATE накопленных сумм события для executemany: параметры b_id, b_yes, b_no, b_count"""
+    events = event_cls.__table__
+    return update(events).where(events.c.id == bindparam("b_id")).values(
+        total_yes=events.c.total_yes + bindparam("b_yes"),
+        total_no=events.c.total_no + bindparam("b_no"),
+        bets_count=events.c.bets_count + bindparam("b_count"),
     )
-    db.add(event)
-    db.commit()
-    db.refresh(event)
-    db.close()
+
+def place_bets(db, event_cls, bet_cls, model_cls, event_ids, decisions):
+    """Ставки всех моделей на набор событий: один INSERT (executemany), один UPDATE моделей и один событий.
+    decisions - {event_id: {model_id: (side, amount)}}; модели без решения ставят случайно.
+    События, рассчитанные, пока агенты думали, и события, на которые ставки уже есть, пропускаются"""
+    E = event_cls
+    event_ids = db.execute(
+        select(E.id).where(E.id.in_(event_ids), E.status.in_(SETTLEABLE_STATUSES), E.bets_count == 0).order_by(E.id)
+    ).scalars().all()
+    models = db.execute(select(model_cls.id, model_cls.name)).all()
+    rows, totals, placed = [], [], {}
+    for event_id in event_ids:
+        sums = {SideEnum.YES: 0, SideEnum.NO: 0}
+        bets = []
+        chosen = decisions.get(event_id, {})
+        for model_id, name in models:
+            side, amount = chosen.get(model_id) or random_bet()
+            rows.append({"model_id": model_id, "event_id": event_id, "side": side, "amount": amount})
+            sums[side] += amount
+            bets.append({"model_id": name, "side": side.value, "amount": amount})
+        totals.append({"b_id": event_id, "b_yes": sums[SideEnum.YES], "b_no": sums[SideEnum.NO], "b_count": len(models)})
+        placed[event_id] = {"bets": bets, "total_yes": sums[SideEnum.YES], "total_no": sums[SideEnum.NO]}
+
+    if rows:
+        db.execute(insert(bet_cls), rows)
+        db.execute(
+            update(model_cls).values(total_bets=model_cls.total_bets + len(event_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(event_totals_update(event_cls), totals)
+    return placed
+
+# Длина окна и шаг даунсэмплинга по умолчанию (секунды)
+PERFORMANCE_WINDOWS = {
+    PerformanceWindow.HOUR: (timedelta(hours=1), 60),
+    PerformanceWindow.DAY: (timedelta(hours=24), 900),
+    PerformanceWindow.WEEK: (timedelta(days=7), 7200),
+    PerformanceWindow.ALL: (None, 86400),
+}
+EPOCH = datetime(1970, 1, 1)
+
+def model_performance(db, history_cls, model_id: str, window: PerformanceWindow, resolution: Optional[int] = None):
+    """Доходность, просадка и win rate модели за окно: один range scan по (model_id, timestamp)"""
+    span, default_resolution = PERFORMANCE_WINDOWS[window]
+    resolution = resolution or default_resolution
+    H = history_cls
+    query = select(H.timestamp, H.balance, H.wins).where(H.model_id == model_id)
+    start_balance, start_wins = 10000, 0
+    if span is not None:
+        since = datetime.utcnow() - span
+        query = query.where(H.timestamp >= since)
+        before = db.execute(
+            select(H.balance, H.wins).where(H.model_id == model_id, H.timestamp < since)
+            .order_by(H.timestamp.desc()).limit(1)
+        ).first()
+        if before is not None:
+            start_balance, start_wins = before
+
+    points, peak, max_drawdown, bets = [], start_balance, 0.0, 0
+    last_bucket = None
+    end_balance, end_wins = start_balance, start_wins
+    for timestamp, balance, wins in db.execute(query.order_by(H.timestamp)):
+        bets += 1
+        # Победы окна - прирост накопленного Model.wins: выигрыш с нулевой выплатой (не было проигравших)
+        # тоже победа, как и в рейтинге
+        end_wins = wins
+        end_balance = balance
+        peak = max(peak, balance)
+        if peak > 0:
+            max_drawdown = max(max_drawdown, (peak - balance) / peak * 100)
+        # Для каждого интервала оставляем последний баланс
+        bucket = int((timestamp - EPOCH).total_seconds()) // resolution
+        point = {"timestamp": EPOCH + timedelta(seconds=bucket * resolution), "balance": balance}
+        if bucket == last_bucket:
+            points[-1] = point
+        else:
+            points.append(point)
+            last_bucket = bucket
+
     return {
-        "id": event.id,
-        "description": event.description,
-        "duration_minutes": event_data.duration_minutes,
-        "start_in_seconds": event_data.start_in_seconds,
-        "status": "upcoming"
+        "model_id": model_id,
+        "window": window,
+        "resolution": resolution,
+        "start_balance": start_balance,
+        "end_balance": end_balance,
+        "return_percent": ((end_balance - start_balance) / start_balance * 100) if start_balance else 0,
+        "max_drawdown": max_drawdown,
+        "win_rate": ((end_wins - start_wins) / bets * 100) if bets else 0,
+        "bets": bets,
+        "points": points,
     }
 
-@app.patch("/events/{event_id}/result")
-async def set_event_result(event_id: int, data: EventResultSchema):
-    await calculate_results(event_id, data.result)
-    return {"status": "ok"}
+def load_event_bets(db, bet_cls, model_cls, event_ids):
+    """Ставки для набора событий одним запросом: {event_id: [строки BetSchema]}"""
+    bets = {event_id: [] for event_id in event_ids}
+    if not bets:
+        return bets
+    rows = db.query(bet_cls.event_id, model_cls.name, bet_cls.side, bet_cls.amount, bet_cls.profit)\
+             .join(model_cls, bet_cls.model_id == model_cls.id)\
+             .filter(bet_cls.event_id.in_(list(bets)))\
+             .order_by(bet_cls.id).all()
+    for event_id, name, side, amount, profit in rows:
+        bets[event_id].append({"model_id": name, "side": side, "amount": amount, "profit": profit})
+    return bets
+
+# -------------------------
+# Leaderboard (materialized, updated on settlement)
+# -------------------------
+class Leaderboard:
+    """Отсортированный рейтинг рынка в памяти: чтение без БД, расчёт обновляет только свои модели"""
+    def __init__(self, session_factory, model_cls):
+        self.session_factory = session_factory
+        self.model_cls = model_cls
+        self.models = {}
+        self.rows = {}
+        self.order = {}
+        self.ranked = []
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def build_row(model: dict):
+        total_bets = model["total_bets"]
+        return {
+            "rank": 0,
+            "model": model["name"],
+            "return_percent": ((model["balance"] - 10000) / 10000) * 100,
+            "total_pnl": model["balance"] - 10000,
+            "win_rate": (model["wins"] / total_bets * 100) if total_bets > 0 else 0,
+            "biggest_win": model["biggest_win"],
+            "biggest_loss": model["biggest_loss"],
+        }
+
+    def _key(self, model_id: str):
+        # При равенстве сохраняем порядок, в котором модели лежат в БД
+        row = self.rows[model_id]
+        return (-row["return_percent"], -row["win_rate"], self.order[model_id]), model_id
+
+    def _set(self, model: dict):
+        rank = self.rows[model["id"]]["rank"] if model["id"] in self.rows else 0
+        self.models[model["id"]] = model
+        self.rows[model["id"]] = dict(self.build_row(model), rank=rank)
+
+    def _rerank(self, start: int, stop: int):
+        changes = []
+        for idx in range(start, stop):
+            row = self.rows[self.ranked[idx][1]]
+            if row["rank"] != idx + 1:
+                if row["rank"]:
+                    changes.append({"model": row["model"], "rank": idx + 1, "previous_rank": row["rank"]})
+                row["rank"] = idx + 1
+        return changes
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self.lock:
+            if not self.loaded:
+                self._load()
+
+    def reload(self):
+        """Перечитывает модели из БД, например после сообщений шины, потерянных за время разрыва"""
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        db = self.session_factory()
+        models = db.query(self.model_cls).all()
+        db.close()
+        for model in models:
+            self.order.setdefault(model.id, len(self.order))
+            self._set(model_row(model))
+        self.ranked = sorted(self._key(model_id) for model_id in self.rows)
+        self._rerank(0, len(self.ranked))
+        self.loaded = True
+
+    def update(self, models):
+        """Пересчитывает строки переданных моделей; возвращает изменения мест"""
+        with self.lock:
+            if not self.loaded:
+                return []
+            lo, hi = len(self.ranked), 0
+            for model in models:
+                model_id = model["id"]
+                if model_id in self.rows:
+                    idx = bisect.bisect_left(self.ranked, self._key(model_id))
+                    del self.ranked[idx]
+                    lo, hi = min(lo, idx), max(hi, idx)
+                else:
+                    self.order[model_id] = len(self.order)
+                self._set(model)
+                idx = bisect.bisect_left(self.ranked, self._key(model_id))
+                self.ranked.insert(idx, self._key(model_id))
+                lo, hi = min(lo, idx), max(hi, idx)
+            # Места меняются только между самой верхней и самой нижней затронутой позицией
+            return self._rerank(lo, min(hi + len(models) + 1, len(self.ranked)))
+
+    def add_bets(self, count: int):
+        """Каждая модель сделала ещё count ставок: win_rate меняется у всех, поэтому пересортировка полная"""
+        with self.lock:
+            if not self.loaded:
+                return []
+            for model in list(self.models.values()):
+                self._set(dict(model, total_bets=model["total_bets"] + count))
+            self.ranked = sorted(self._key(model_id) for model_id in self.rows)
+            return self._rerank(0, len(self.ranked))
+
+    def page(self, offset: int = 0, limit: Optional[int] = None):
+        with self.lock:
+            keys = self.ranked[offset:None if limit is None else offset + limit]
+            return [dict(self.rows[model_id]) for _, model_id in keys]
+
+    def has(self, model_id: str):
+        with self.lock:
+            return model_id in self.rows
+
+    def rows_for(self, model_ids):
+        with self.lock:
+            return [dict(self.rows[model_id]) for model_id in model_ids if model_id in self.rows]
+
+
+# -------------------------
+# Bet archive
+# -------------------------
+class BetArchive:
+    """Отдельный SQLite-файл рынка для ставок архивных событий. В горячей БД от события остаётся строка events
+    (итоги и результат) и строки balance_history (прибыль каждой модели)"""
+    def __init__(self, name: str, db_file: str):
+        self.db_file = db_file
+        self.engine = create_engine(f"sqlite:///{db_file}", connect_args={"check_same_thread": False})
+        sa_event.listen(self.engine, "connect", apply_sqlite_pragmas)
+        count_queries(self.engine, f"{name}:archive")
+
+    def store(self, bets, archived_at: datetime):
+        """{event_id: [ставки]}; REPLACE - повтор после сбоя между двумя базами перезапишет те же строки"""
+        with self.engine.begin() as conn:
+            conn.execute(insert(ArchivedBets).prefix_with("OR REPLACE"), [{
+                "event_id": event_id,
+                "archived_at": archived_at,
+                "bets": dump_json(rows).decode("utf-8"),
+            } for event_id, rows in bets.items()])
+
+    def load(self, event_ids):
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(ArchivedBets.event_id, ArchivedBets.bets).where(ArchivedBets.event_id.in_(list(event_ids)))
+            ).all()
+        return {event_id: json.loads(bets) for event_id, bets in rows}
 
 # -------------------------
-# Endpoints - Community Markets
-# -------------------------
-@app.get("/community/models", response_model=List[ModelSchema])
-def get_community_models():
-    db = CommunitySessionLocal()
-    models = db.query(CommunityModel).all()
-    db.close()
-    return [ModelSchema(**m.__dict__) for m in models]
-
-@app.get("/community/events/current", response_model=Optional[CommunityEventSchema])
-def get_current_community_event():
-    db = CommunitySessionLocal()
-    event = db.query(CommunityEvent).options(joinedload(CommunityEvent.bets).joinedload(CommunityBet.model)).filter_by(status="active").first()
-    db.close()
-    if event:
-        total_yes = sum(b.amount for b in event.bets if b.side==SideEnum.YES)
-        total_no = sum(b.amount for b in event.bets if b.side==SideEnum.NO)
-        return CommunityEventSchema(
-            id=event.id,
-            description=event.description,
-            username=event.username,
-            twitter_link=event.twitter_link,
-            avatar_url=event.avatar_url,
-            start_time=event.start_time,
-            end_time=event.end_time,
-            status=event.status,
-            result=event.result,
-            total_yes=total_yes,
-            total_no=total_no,
-            bets=[BetSchema(model_id=b.model.name, side=b.side, amount=b.amount, profit=b.profit) for b in event.bets]
+# Market engine
+# -------------------------
+SETTLE_RESPONSES = {
+    SettleOutcome.SETTLED: (200, {"status": "ok", "outcome": "settled"}),
+    SettleOutcome.ALREADY_SETTLED: (200, {"status": "ok", "outcome": "already_settled"}),
+    SettleOutcome.CONFLICT: (409, {"detail": "Event is already settled with a different result"}),
+    SettleOutcome.NOT_FOUND: (404, {"detail": "Event not found"}),
+    SettleOutcome.NOT_STARTED: (409, {"detail": "Event has not started yet"}),
+}
+EVENT_HISTORY_MAX_LIMIT = 200
+# Окно group commit писателя (секунды) и максимум операций в одном commit
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW", "0.002"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "64"))
+
+class MarketTables:
+    """ORM-классы и схемы одного вида рынка. Шард или ещё один рынок того же вида переиспользует их со своей БД"""
+    def __init__(self, base, model_cls, event_cls, bet_cls, history_cls, key_cls,
+                 event_schema, create_schema, event_fields: List[str]):
+        self.base = base
+        self.model_cls = model_cls
+        self.event_cls = event_cls
+        self.bet_cls = bet_cls
+        self.history_cls = history_cls
+        self.key_cls = key_cls
+        self.event_schema = event_schema
+        self.create_schema = create_schema
+        self.event_fields = event_fields
+
+class Market:
+    """Рынок целиком: своя БД и сессии, кэш ответов, рассылки и рейтинг. Планировщик и маршруты общие для всех рынков"""
+    def __init__(self, name: str, prefix: str, db_file: str, tables: MarketTables):
+        self.name = name
+        self.prefix = prefix
+        self.db_file = db_file
+        self.tables = tables
+        self.model_cls = tables.model_cls
+        self.event_cls = tables.event_cls
+        self.bet_cls = tables.bet_cls
+        self.history_cls = tables.history_cls
+
+        self.engine = create_engine(f"sqlite:///{db_file}", connect_args={"check_same_thread": False})
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Все записи рынка идут через одного писателя с group commit; читают def-эндпоинты (threadpool, SessionLocal)
+        # и корутины через aiosqlite, не блокируя event loop
+        self.writer = WriteQueue(name, self.SessionLocal, WRITE_BATCH_WINDOW, WRITE_BATCH_MAX)
+        self.async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_file}")
+        self.AsyncSessionLocal = async_sessionmaker(self.async_engine, autoflush=False, expire_on_commit=False)
+        for bind in (self.engine, self.async_engine.sync_engine):
+            sa_event.listen(bind, "connect", apply_sqlite_pragmas)
+            count_queries(bind, name)
+
+        self.archive = BetArchive(name, f"{os.path.splitext(db_file)[0]}_archive.db")
+
+        self.cache = ResponseCache()
+        self.bubble_map = ConnectionManager(f"{name}:bubble_map")
+        self.feed = MarketFeed(ConnectionManager(f"{name}:feed", close_slow=True))
+        self.leaderboard = Leaderboard(self.SessionLocal, self.model_cls)
+        self.channel = f"market:{name}"
+        self.scheduler = None
+        self.bus = None
+
+    def migrate(self):
+        apply_migrations(self.engine, market_migrations(self))
+        apply_migrations(self.archive.engine, ARCHIVE_MIGRATIONS)
+
+    def seed_models(self, names: List[str]):
+        """Один INSERT ... ON CONFLICT DO NOTHING: существующие модели не трогает, параллельный старт воркеров не падает"""
+        with self.engine.begin() as conn:
+            conn.execute(sqlite_insert(self.model_cls).values([
+                {"id": name.lower().replace(" ", "_"), "name": name} for name in names
+            ]).on_conflict_do_nothing())
+
+    def event_rows(self, db, names, include_bets: bool, *criteria, order_by, limit: int):
+        """Строки событий прямо из кортежей SQL: читаются только колонки из names, ставки - только если нужны"""
+        E = self.event_cls
+        columns = [name for name in names if name not in ("id", "bets")]
+        rows = db.execute(
+            select(E.id, E.archived_at, *[getattr(E, name) for name in columns])
+            .where(*criteria).order_by(order_by).limit(limit)
+        ).all()
+        bets = {}
+        if include_bets and "bets" in names:
+            # Ставки архивных событий читаются из файла архива, остальные - из горячей таблицы
+            archived = [row[0] for row in rows if row[1] is not None]
+            bets = load_event_bets(db, self.bet_cls, self.model_cls, [row[0] for row in rows if row[1] is None])
+            if archived:
+                bets.update(self.archive.load(archived))
+
+        result = []
+        for event_id, _, *values in rows:
+            row = dict(zip(columns, values), id=event_id, bets=bets.get(event_id, []))
+            result.append({name: row[name] for name in names})
+        return result
+
+    # Загрузчики для кэша ответов (выполняются в threadpool)
+    def load_models(self):
+        M = self.model_cls
+        db = self.SessionLocal()
+        rows = db.execute(select(*[getattr(M, name) for name in MODEL_FIELDS])).all()
+        db.close()
+        return [dict(zip(MODEL_FIELDS, row)) for row in rows]
+
+    def load_current_event(self):
+        E = self.event_cls
+        db = self.SessionLocal()
+        rows = self.event_rows(db, list(self.tables.event_schema.model_fields), True,
+                               E.status == "active", order_by=E.id, limit=1)
+        db.close()
+        return rows[0] if rows else None
+
+    def event_history_fields(self, fields: Optional[str]):
+        """Разбирает fields=id,status,...; None - все поля схемы"""
+        if not fields:
+            return None
+        names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        unknown = [name for name in names if name not in self.tables.event_schema.model_fields]
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"Unknown fields: {', '.join(unknown)}")
+        return names
+
+    def load_event_history(self, limit: int = 50, include_bets: bool = True,
+                           before_id: Optional[int] = None, fields: Optional[tuple] = None):
+        """Страница истории по убыванию id (keyset): следующая страница - before_id = id последнего события"""
+        E = self.event_cls
+        db = self.SessionLocal()
+        rows = self.event_rows(db, list(fields or self.tables.event_schema.model_fields), include_bets,
+                               *([E.id < before_id] if before_id is not None else []),
+                               order_by=E.id.desc(), limit=limit)
+        db.close()
+        return rows
+
+    def load_leaderboard(self, offset: int = 0, limit: Optional[int] = None):
+        self.leaderboard.ensure_loaded()
+        return self.leaderboard.page(offset, limit)
+
+    def load_model_performance(self, model_id: str, window: PerformanceWindow, resolution: Optional[int]):
+        db = self.SessionLocal()
+        data = model_performance(db, self.history_cls, model_id, window, resolution)
+        db.close()
+        return data
+
+    def create_event(self, db, event_data):
+        """Операция писателя: возвращает (время старта, ответ POST /events)"""
+        event = self.event_cls(
+            description=event_data.description,
+            **{name: getattr(event_data, name) for name in self.tables.event_fields},
+            start_time=datetime.utcnow(),
+            end_time=datetime.utcnow() + timedelta(minutes=event_data.duration_minutes),
+            start_in_seconds=event_data.start_in_seconds,
+            duration_minutes=event_data.duration_minutes
         )
-    return None
-
-@app.get("/community/events/history", response_model=List[CommunityEventSchema])
-def get_community_event_history(limit: int = 50):
-    db = CommunitySessionLocal()
-    events = db.query(CommunityEvent).options(joinedload(CommunityEvent.bets).joinedload(CommunityBet.model))\
-               .order_by(CommunityEvent.id.desc()).limit(limit).all()
-    db.close()
-    result = []
-    for e in events:
-        total_yes = sum(b.amount for b in e.bets if b.side==SideEnum.YES)
-        total_no = sum(b.amount for b in e.bets if b.side==SideEnum.NO)
-        result.append(CommunityEventSchema(
-            id=e.id,
-            description=e.description,
-            username=e.username,
-            twitter_link=e.twitter_link,
-            avatar_url=e.avatar_url,
-            start_time=e.start_time,
-            end_time=e.end_time,
-            status=e.status,
-            result=e.result,
-            total_yes=total_yes,
-            total_no=total_no,
-            bets=[BetSchema(model_id=b.model.name, side=b.side, amount=b.amount, profit=b.profit) for b in e.bets]
-        ))
-    return result
-
-@app.get("/community/leaderboard", response_model=List[LeaderboardSchema])
-def get_community_leaderboard():
-    db = CommunitySessionLocal()
-    models = db.query(CommunityModel).all()
-    db.close()
-    data = []
-    for m in models:
-        win_rate = (m.wins / m.total_bets * 100) if m.total_bets > 0 else 0
-        data.append({
-            "model": m.name,
-            "return_percent": ((m.balance - 10000) / 10000) * 100, 
-            "total_pnl": m.balance - 10000,                        
-            "win_rate": win_rate,
-            "biggest_win": m.biggest_win,
-            "biggest_loss": m.biggest_loss
-        })
-
-    data.sort(key=lambda x: (-x["return_percent"], -x["win_rate"]))
-    for idx, d in enumerate(data):
-        d["rank"] = idx + 1
-    return data
-
-@app.post("/community/events")
-def add_community_event(event_data: CommunityEventCreateSchema):
-    db = CommunitySessionLocal()
-    event = CommunityEvent(
-        description=event_data.description,
-        username=event_data.username,
-        twitter_link=event_data.twitter_link,
-        avatar_url=event_data.avatar_url,
-        start_time=datetime.utcnow(),
-        end_time=datetime.utcnow() + timedelta(minutes=event_data.duration_minutes),
-        start_in_seconds=event_data.start_in_seconds,
-        duration_minutes=event_data.duration_minutes
-    )
-    db.add(event)
-    db.commit()
-    db.refresh(event)
-    db.close()
-    return {
-        "id": event.id,
-        "description": event.description,
-        "username": event.username,
-        "twitter_link": event.twitter_link,
-        "avatar_url": event.avatar_url,
-        "duration_minutes": event_data.duration_minutes,
-        "start_in_seconds": event_data.start_in_seconds,
-        "status": "upcoming"
-    }
+        db.add(event)
+        db.flush()
+        return event.start_time + timedelta(seconds=event.start_in_seconds), {
+            "id": event.id,
+            "description": event.description,
+            **{name: getattr(event, name) for name in self.tables.event_fields},
+            "duration_minutes": event_data.duration_minutes,
+            "start_in_seconds": event_data.start_in_seconds,
+            "status": "upcoming"
+        }
+
+    def archive_finished(self, db, cutoff: datetime, batch: int):
+        """Операция писателя: переносит в архив ставки одной пачки событий, рассчитанных с end_time раньше cutoff.
+        Архив коммитится раньше горячей БД: при сбое между ними пачка просто повторится.
+        Освободившиеся страницы SQLite займут новые ставки, так что файл горячей БД перестаёт расти.
+        Возвращает число перенесённых событий"""
+        E, B, K = self.event_cls, self.bet_cls, self.tables.key_cls
+        # Условие без status = ?, иначе SQLite без ANALYZE выбирает ix_events_status и читает все finished
+        event_ids = db.execute(
+            select(E.id).where(E.result.is_not(None), E.archived_at.is_(None), E.end_time < cutoff)
+            .order_by(E.end_time).limit(batch)
+        ).scalars().all()
+        if not event_ids:
+            return 0
+        now = datetime.utcnow()
+        self.archive.store(load_event_bets(db, B, self.model_cls, event_ids), now)
+        db.execute(delete(B).where(B.event_id.in_(event_ids)))
+        db.execute(update(E).where(E.id.in_(event_ids)).values(archived_at=now)
+                   .execution_options(synchronize_session=False))
+        # Повтор PATCH архивного события получит ответ заново, уже без ключа
+        db.execute(delete(K).where(K.event_id.in_(event_ids)))
+        return len(event_ids)
+
+    async def add_event(self, event_data):
+        starts_at, response = await self.writer.submit(self.create_event, event_data)
+        self.cache.invalidate()
+        await self.emit("created", id=response["id"], starts_at=starts_at)
+        return response
+
+    async def generate_bets(self, events):
+        """Ставки на активированные события: решения агентов собираются параллельно и пишутся одной операцией"""
+        with BETS_LATENCY.time(self.name):
+            async with self.AsyncSessionLocal() as db:
+                model_ids = (await db.execute(select(self.model_cls.id))).scalars().all()
+            decisions = await agent_bets(model_ids, events)
+            placed = await self.writer.submit(place_bets, self.event_cls, self.bet_cls, self.model_cls,
+                                              [event["id"] for event in events], decisions)
+        if not placed:
+            return
+        self.cache.invalidate()
+        await self.emit("bets_placed", count=len(placed),
+                        events=[{"event_id": event_id, **data} for event_id, data in placed.items()])
+
+    def settle_sync(self, db, event_id: int, result: SideEnum, idempotency_key: Optional[str]):
+        """Операция писателя: ключ идемпотентности, расчёт и сохранённый ответ попадают в один commit.
+        Возвращает (HTTP-код, тело ответа, (bubble_map, модели) или None)"""
+        K = self.tables.key_cls
+        if idempotency_key is not None:
+            # INSERT ключа первым оператором сразу берёт блокировку записи SQLite
+            inserted = db.execute(
+                sqlite_insert(K).values(key=idempotency_key, event_id=event_id, result=result, created_at=datetime.utcnow())
+                .on_conflict_do_nothing()
+            ).rowcount
+            if not inserted:
+                stored = db.execute(
+                    select(K.event_id, K.result, K.status_code, K.response).where(K.key == idempotency_key)
+                ).first()
+                if stored.event_id != event_id:
+                    return 422, {"detail": "Idempotency-Key was already used for another event"}, None
+                # Ключи, сохранённые до появления колонки result, сверяются только по событию
+                if stored.result is not None and stored.result != result:
+                    return 422, {"detail": "Idempotency-Key was already used with a different result"}, None
+                return stored.status_code, json.loads(stored.response), None
+
+        with SETTLE_LATENCY.time(self.name):
+            outcome, items, touched = settle_event(db, self.event_cls, self.bet_cls, self.model_cls, self.history_cls,
+                                                   event_id, result)
+        status_code, body = SETTLE_RESPONSES[outcome]
+        body = dict(body, event_id=event_id, result=result.value) if status_code == 200 else body
+        if idempotency_key is not None:
+            db.execute(update(K).where(K.key == idempotency_key)
+                       .values(status_code=status_code, response=dump_json(body).decode("utf-8")))
+        return status_code, body, (items, touched) if outcome == SettleOutcome.SETTLED else None
+
+    async def settle(self, event_id: int, result: SideEnum, idempotency_key: Optional[str] = None):
+        status_code, body, settled = await self.writer.submit(self.settle_sync, event_id, result, idempotency_key)
+        if settled is not None:
+            items, touched = settled
+            self.cache.invalidate()
+            await self.emit("settled", events=[{"event_id": event_id, "result": result.value, "bubble_map": items}],
+                            bubble_map=items, models=touched)
+        return status_code, body
+
+    def settle_many_sync(self, db, results):
+        """Операция писателя: пачка расчётов одной транзакцией. Модели пачки - одни и те же объекты сессии, поэтому балансы
+        и balance_history идут по порядку событий. Повтор пачки безопасен: рассчитанные события вернут
+        already_settled. Возвращает (ответы по событиям, рассчитанные события, состояние затронутых моделей)"""
+        responses, settled, models = [], [], {}
+        for event_id, result in results:
+            with SETTLE_LATENCY.time(self.name):
+                outcome, items, touched = settle_event(db, self.event_cls, self.bet_cls, self.model_cls,
+                                                       self.history_cls, event_id, result)
+            status_code, body = SETTLE_RESPONSES[outcome]
+            responses.append(dict(body, event_id=event_id, result=result.value,
+                                  outcome=outcome.value, status_code=status_code))
+            if outcome == SettleOutcome.SETTLED:
+                settled.append({"event_id": event_id, "result": result.value, "bubble_map": items})
+                models.update((model["id"], model) for model in touched)
+        return responses, settled, list(models.values())
+
+    async def settle_many(self, results):
+        """[(event_id, result)] -> ответы по событиям; подписчики получают один общий bubble_map"""
+        responses, settled, touched = await self.writer.submit(self.settle_many_sync, results)
+        if settled:
+            self.cache.invalidate()
+            await self.emit("settled", events=settled, bubble_map=coalesce_bubble_map(settled), models=touched)
+        return responses
+
+    # -------------------------
+    # Изменения рынка рассылаются через шину: каждый воркер (и этот тоже) сбрасывает свой кэш,
+    # обновляет свой рейтинг и отправляет сообщения своим сокетам
+    # -------------------------
+    async def emit(self, op: str, **data):
+        payload = dump_json({"op": op, **data})
+        try:
+            await self.bus.publish(self.channel, payload)
+        except Exception as e:
+            # Запись уже закоммичена - клиент не должен получить 500. Этот воркер применяет изменение сам,
+            # остальные наверстают после переподключения к шине и страховочного перечитывания дедлайнов
+            print(f"❌ Event bus publish failed ({self.name}, {op}): {e}; applying locally")
+            try:
+                await self.apply(payload)
+            except Exception as e:
+                print(f"❌ Local apply failed ({self.name}, {op}): {e}")
+
+    async def resync(self):
+        """После разрыва шины: всё, что этот воркер строил из её сообщений, собирается заново"""
+        self.cache.invalidate()
+        await run_in_threadpool(self.leaderboard.reload)
+        self.feed.reset()
+
+    async def apply(self, payload: bytes):
+        message = json.loads(payload)
+        op = message["op"]
+        self.cache.invalidate()
+        if op == "created":
+            self.scheduler.schedule(datetime.fromisoformat(message["starts_at"]), "start", self.name, message["id"])
+        elif op == "advanced":
+            for event_id in message["closed"]:
+                await self.feed.publish("event_closed", {"id": event_id})
+            for event in message["activated"]:
+                await self.feed.publish("event_activated", event)
+        elif op == "bets_placed":
+            rank_changes = self.leaderboard.add_bets(message["count"])
+            for data in message["events"]:
+                await self.feed.publish("bets_placed", data)
+            await self.feed.publish("leaderboard", {"rows": self.leaderboard.page(), "rank_changes": rank_changes})
+        elif op == "settled":
+            # Одно сообщение и на один расчёт, и на пачку: bubble_map и рейтинг - один раз, event_settled - на событие
+            touched = message["models"]
+            rank_changes = self.leaderboard.update(touched)
+            await self.bubble_map.broadcast({"type": "bubble_map", "data": message["bubble_map"]})
+            for event in message["events"]:
+                await self.feed.publish("event_settled", event)
+            await self.feed.publish("leaderboard", {
+                "rows": self.leaderboard.rows_for(model["id"] for model in touched),
+                "rank_changes": rank_changes,
+            })
+
+    async def deadlines(self):
+        """Дедлайны незавершённых событий для планировщика: [(when, kind, event_id)]"""
+        E = self.event_cls
+        async with self.AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(E.id, E.status, E.start_time, E.start_in_seconds, E.end_time)
+                .where(E.status.in_(("upcoming", "active")))
+            )).all()
+        result = []
+        for event_id, status, start_time, start_in_seconds, end_time in rows:
+            if status == "upcoming":
+                result.append((start_time + timedelta(seconds=start_in_seconds), "start", event_id))
+            elif end_time:
+                result.append((end_time, "end", event_id))
+        return result
+
+    async def unbet_events(self):
+        """Идущие события без ставок: их задачи ставок не дожили до commit (остановка, смена лидера)"""
+        E = self.event_cls
+        async with self.AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(E.id, E.description).where(E.status == "active", E.bets_count == 0).order_by(E.id)
+            )).all()
+        return [{"id": event_id, "description": description} for event_id, description in rows]
+
+    def advance_sync(self, db, starts, ends, now: datetime):
+        """Операция писателя: активирует и закрывает наступившие события; возвращает (активированные, закрытые id)"""
+        E = self.event_cls
+        activated, closed = [], []
+        if starts:
+            for event in db.execute(
+                select(E).where(E.id.in_(starts), E.status == "upcoming").order_by(E.id)
+            ).scalars():
+                event.start_time = now
+                event.end_time = now + timedelta(minutes=event.duration_minutes)
+                event.status = "active"
+                activated.append({
+                    "id": event.id,
+                    "description": event.description,
+                    "start_time": event.start_time,
+                    "end_time": event.end_time,
+                })
+        if ends:
+            closed = db.execute(
+                select(E.id).where(E.id.in_(ends), E.status == "active", E.end_time <= now)
+            ).scalars().all()
+            if closed:
+                db.execute(update(E).where(E.id.in_(closed)).values(status="closed")
+                           .execution_options(synchronize_session=False))
+        return activated, closed
+
+    async def advance(self, starts, ends, now: datetime):
+        """Активирует и закрывает наступившие события одним commit; возвращает активированные"""
+        activated, closed = await self.writer.submit(self.advance_sync, starts, ends, now)
+        if not activated and not closed:
+            return []
+
+        self.cache.invalidate()
+        await self.emit("advanced", closed=closed, activated=activated)
+        return activated
+
+    async def serve_bubble_map(self, ws: WebSocket):
+        await self.bubble_map.connect(ws)
+        try:
+            async with self.AsyncSessionLocal() as db:
+                models = (await db.execute(select(self.model_cls))).scalars().all()
+            items = [{"model": m.name, "balance": m.balance, "delta": m.balance} for m in models]
+            self.bubble_map.send(ws, {"type":"bubble_map", "data": items})
+
+            while True:
+                await ws.receive_text()
+        except WebSocketDisconnect:
+            self.bubble_map.disconnect(ws)
+
+    async def serve_feed(self, ws: WebSocket, since: int, epoch: Optional[str]):
+        """Отдаёт пропущенные сообщения (или снимок рынка) и держит сокет в канале рынка"""
+        snapshot = None
+        missed = self.feed.replay(since, epoch)
+        # Пропущенное, которое не влезет в очередь клиента, заменяется снимком
+        if missed is None or len(missed) >= self.feed.connections.queue_size:
+            since, epoch = self.feed.seq, self.feed.epoch
+            snapshot = {
+                "seq": since,
+                "epoch": epoch,
+                "type": "snapshot",
+                "data": {
+                    "current_event": await run_in_threadpool(cached_payload, self.cache, "events/current",
+                                                             self.load_current_event),
+                    "leaderboard": await run_in_threadpool(cached_payload, self.cache, ("leaderboard", 0, None),
+                                                           self.load_leaderboard),
+                },
+            }
+
+        # Между регистрацией сокета и постановкой в очередь нет await, поэтому порядок seq сохраняется
+        await self.feed.connections.connect(ws)
+        try:
+            if snapshot:
+                self.feed.connections.send(ws, snapshot)
+            for message in self.feed.replay(since, epoch) or []:
+                self.feed.connections.send(ws, message)
+
+            while True:
+                await ws.receive_text()
+        except WebSocketDisconnect:
+            self.feed.connections.disconnect(ws)
+
+    def stats(self):
+        return {
+            "bubble_map": self.bubble_map.stats(),
+            "feed": self.feed.connections.stats(),
+            "writer": self.writer.stats(),
+        }
 
-@app.patch("/community/events/{event_id}/result")
-async def set_community_event_result(event_id: int, data: EventResultSchema):
-    await calculate_community_results(event_id, data.result)
-    return {"status": "ok"}
+# -------------------------
+# Scheduler (one task for all markets)
+# -------------------------
+# Пауза перед повтором после сбоя такта или лидерства: удваивается до максимума, успех сбрасывает её
+SCHEDULER_RETRY_MIN, SCHEDULER_RETRY_MAX = 1, 30
+
+class EventScheduler:
+    """Мин-куча дедлайнов старта/окончания событий всех рынков: спим ровно до ближайшего, БД трогаем только по делу.
+    При нескольких воркерах кучу ведёт только держатель аренды, остальные ждут её освобождения"""
+    def __init__(self, lease, reload_interval: Optional[float] = None):
+        self.lease = lease
+        self.reload_interval = reload_interval
+        self.markets = {}
+        self.heap = []
+        self.queued = set()
+        self.tasks = set()
+        self.leader = False
+        self.task = None
+        self.wakeup = None
+        self.retry = SCHEDULER_RETRY_MIN
+        self.failures = 0
+
+    def register(self, market: Market):
+        self.markets[market.name] = market
+        market.scheduler = self
+
+    def schedule(self, when: datetime, kind: str, market_name: str, event_id: int):
+        """Вызывается из event loop. Не лидер событие пропускает: новый лидер поднимет его из БД в load()"""
+        if self.leader:
+            self._push(when, kind, market_name, event_id)
+            self.wakeup.set()
+
+    def _push(self, when: datetime, kind: str, market_name: str, event_id: int):
+        if (kind, market_name, event_id) not in self.queued:
+            self.queued.add((kind, market_name, event_id))
+            heapq.heappush(self.heap, (when, kind, market_name, event_id))
+
+    async def load(self):
+        """Дедлайны из БД при получении аренды и, если задан reload_interval, раз в reload_interval секунд.
+        Новые события приходят через schedule(), так что перечитывание - только страховка"""
+        for market in self.markets.values():
+            for when, kind, event_id in await market.deadlines():
+                self._push(when, kind, market.name, event_id)
+
+    async def acquire(self):
+        try:
+            return await self.lease.acquire()
+        except Exception as e:
+            print(f"❌ Scheduler lease check failed: {e}")
+            return False
+
+    async def run(self):
+        self.wakeup = asyncio.Event()
+        while True:
+            if not await self.acquire():
+                await asyncio.sleep(self.lease.renew_interval)
+                continue
+            try:
+                await self.lead()
+                print("⚠️ Scheduler lease lost")
+            except Exception as e:
+                # Задача планировщика не должна умирать: куча собирается заново из БД после паузы
+                self.failures += 1
+                print(f"❌ Scheduler failed: {e}; restarting in {self.retry}s")
+                self.leader = False
+                self.heap = []
+                self.queued = set()
+                await asyncio.sleep(self.retry)
+                self.retry = min(self.retry * 2, SCHEDULER_RETRY_MAX)
+                continue
+            self.heap = []
+            self.queued = set()
+
+    async def lead(self):
+        """Ведёт кучу, пока аренда за этим процессом"""
+        loop = asyncio.get_running_loop()
+        print(f"✓ Scheduler leader: {self.lease.owner}")
+        self.leader = True
+        await self.load()
+        for market in self.markets.values():
+            events = await market.unbet_events()
+            if events:
+                print(f"🔄 Placing missing bets on {len(events)} active events ({market.name})")
+                self.spawn_bets(market, events)
+        renew_at = loop.time() + self.lease.renew_interval
+        reload_at = loop.time() + (self.reload_interval or 0)
+        while self.leader:
+            now = datetime.utcnow()
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap))
+                self.queued.discard(due[-1][1:])
+            if due:
+                with SCHEDULER_TICK.time():
+                    await self.process(due, now)
+                continue
+
+            if loop.time() >= renew_at:
+                self.leader = await self.acquire()
+                if self.leader and self.reload_interval and loop.time() >= reload_at:
+                    await self.load()
+                    reload_at = loop.time() + self.reload_interval
+                renew_at = loop.time() + self.lease.renew_interval
+                continue
+
+            timeout = renew_at - loop.time()
+            if self.heap:
+                timeout = min(timeout, (self.heap[0][0] - now).total_seconds())
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def refresh(self):
+        """Внеочередное перечитывание дедлайнов (после разрыва шины могли потеряться сообщения created)"""
+        if self.leader:
+            await self.load()
+            self.wakeup.set()
+
+    def spawn_bets(self, market: Market, events):
+        task = asyncio.create_task(market.generate_bets(events))
+        self.tasks.add(task)
+        task.add_done_callback(self._bets_done)
+
+    def _bets_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"❌ Bets generation failed: {task.exception()}")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"❌ Scheduler task had failed: {e}")
+            self.task = None
+        # Ставки, ещё ждущие LLM, отменяются до остановки писателей: события без ставок доставит следующий лидер
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.leader:
+            self.leader = False
+            await self.lease.release()
+
+    async def process(self, due, now: datetime):
+        """Одна транзакция на рынок; ставки генерируются отдельными задачами и не задерживают остальные рынки"""
+        by_market = {}
+        for _, kind, market_name, event_id in due:
+            starts, ends = by_market.setdefault(market_name, (set(), set()))
+            (starts if kind == "start" else ends).add(event_id)
+
+        for market_name, (starts, ends) in by_market.items():
+            market = self.markets[market_name]
+            try:
+                activated = await market.advance(starts, ends, now)
+            except Exception as e:
+                # Дедлайны рынка возвращаются в кучу с паузой; advance повтор не задвоит - он смотрит на статус
+                self.failures += 1
+                print(f"❌ Scheduler tick failed ({market_name}): {e}; retrying in {self.retry}s")
+                retry_at = now + timedelta(seconds=self.retry)
+                for event_id in starts:
+                    self._push(retry_at, "start", market_name, event_id)
+                for event_id in ends:
+                    self._push(retry_at, "end", market_name, event_id)
+                self.retry = min(self.retry * 2, SCHEDULER_RETRY_MAX)
+                continue
+            self.retry = SCHEDULER_RETRY_MIN
+            for event in activated:
+                self._push(event["end_time"], "end", market_name, event["id"])
+            if activated:
+                self.spawn_bets(market, activated)
+
+# -------------------------
+# Archiver (bets of old finished events leave the hot database)
+# -------------------------
+class Archiver:
+    """Раз в interval секунд переносит в архив ставки событий, рассчитанных раньше retention.
+    Работает только у лидера планировщика, чтобы воркеры не делили блокировку записи ради одной работы"""
+    def __init__(self, scheduler: EventScheduler, retention: timedelta, interval: float, batch: int):
+        self.scheduler = scheduler
+        self.retention = retention
+        self.interval = interval
+        self.batch = batch
+        self.task = None
+        self.last_run = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.scheduler.leader:
+                await self.archive()
+
+    async def archive(self):
+        cutoff = datetime.utcnow() - self.retention
+        for market in self.scheduler.markets.values():
+            try:
+                # Пачками: каждая - короткая транзакция, между ними успевают пройти расчёты и ставки
+                while True:
+                    with ARCHIVE_LATENCY.time(market.name):
+                        count = await market.writer.submit(market.archive_finished, cutoff, self.batch)
+                    if count:
+                        ARCHIVED_EVENTS.inc(market.name, amount=count)
+                        print(f"📦 Archived {count} events ({market.name})")
+                    if count < self.batch:
+                        break
+            except Exception as e:
+                print(f"❌ Archive failed ({market.name}): {e}")
+        self.last_run = datetime.utcnow()
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+# -------------------------
+# Markets
+# -------------------------
+# Новый рынок или шард загруженного - ещё одна строка здесь: своя БД, свой префикс маршрутов
+MAIN_TABLES = MarketTables(Base, Model, Event, Bet, BalanceSnapshot, IdempotencyKey,
+                           EventSchema, EventCreateSchema, ["market_link"])
+COMMUNITY_TABLES = MarketTables(CommunityBase, CommunityModel, CommunityEvent, CommunityBet, CommunityBalanceSnapshot,
+                                CommunityIdempotencyKey, CommunityEventSchema, CommunityEventCreateSchema, ["username", "twitter_link", "avatar_url"])
+
+main_market = Market("main", "", "./arena.db", MAIN_TABLES)
+community_market = Market("community", "/community", "./arena_community.db", COMMUNITY_TABLES)
+MARKETS = [main_market, community_market]
+
+# Один планировщик на кластер (аренда в основной БД) и шина, через которую воркеры узнают об изменениях рынков.
+# Шина в памяти - один процесс: аренда и перечитывание дедлайнов не нужны, простаивающий сервис не ходит в БД.
+# С общей шиной лидер изредка перечитывает дедлайны - страховка от потерянного сообщения created
+bus = bus_from_env()
+WORKERS = configured_workers()
+if bus.shared or WORKERS > 1:
+    lease = SQLiteLease(main_market.async_engine, "scheduler", float(os.getenv("SCHEDULER_LEASE_TTL", "15")))
+    scheduler = EventScheduler(lease, reload_interval=float(os.getenv("SCHEDULER_RELOAD_INTERVAL", "300")))
+else:
+    scheduler = EventScheduler(LocalLease())
+archiver = Archiver(scheduler,
+                    retention=timedelta(hours=float(os.getenv("ARCHIVE_RETENTION_HOURS", "168"))),
+                    interval=float(os.getenv("ARCHIVE_INTERVAL", "600")),
+                    batch=int(os.getenv("ARCHIVE_BATCH", "500")))
+for market in MARKETS:
+    scheduler.register(market)
+    market.bus = bus
+    bus.subscribe(market.channel, market.apply)
+
+async def resync_after_bus_reconnect():
+    for market in MARKETS:
+        await market.resync()
+    await scheduler.refresh()
+
+bus.on_reconnect(resync_after_bus_reconnect)
+
+def prepare_databases():
+    """Схема, миграции и модели всех рынков. Выполняется на старте процесса (в threadpool), а не при импорте"""
+    for market in MARKETS:
+        market.migrate()
+        market.seed_models(MODEL_NAMES)
+
+# -------------------------
+# Endpoints - per market
+# -------------------------
+def register_market_routes(market: Market):
+    prefix = market.prefix
+    event_schema = market.tables.event_schema
+    create_schema = market.tables.create_schema
+
+    @app.get(prefix + "/models", response_model=List[ModelSchema])
+    def get_models(request: Request):
+        return cached_response(request, market.cache, "models", market.load_models)
+
+    @app.get(prefix + "/events/current", response_model=Optional[event_schema])
+    def get_current_event(request: Request):
+        return cached_response(request, market.cache, "events/current", market.load_current_event)
+
+    @app.get(prefix + "/events/history", response_model=List[event_schema])
+    def get_event_history(request: Request, limit: int = Query(50, ge=1, le=EVENT_HISTORY_MAX_LIMIT),
+                          include_bets: bool = True, before_id: Optional[int] = None, fields: Optional[str] = None):
+        names = market.event_history_fields(fields)
+        return cached_response(request, market.cache, ("events/history", limit, include_bets, before_id, names),
+                               lambda: market.load_event_history(limit, include_bets, before_id, names))
+
+    @app.get(prefix + "/leaderboard", response_model=List[LeaderboardSchema])
+    def get_leaderboard(request: Request, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+        return cached_response(request, market.cache, ("leaderboard", offset, limit),
+                               lambda: market.load_leaderboard(offset, limit))
+
+    @app.get(prefix + "/models/{model_id}/performance", response_model=PerformanceSchema)
+    def get_model_performance(request: Request, model_id: str, window: PerformanceWindow = PerformanceWindow.DAY,
+                              resolution: Optional[int] = Query(None, ge=1)):
+        # Модели рынка известны рейтингу в памяти: неизвестный id не доходит ни до БД, ни до кэша
+        market.leaderboard.ensure_loaded()
+        if not market.leaderboard.has(model_id):
+            raise HTTPException(status_code=404, detail="Model not found")
+        return cached_response(request, market.cache, ("performance", model_id, window, resolution),
+                               lambda: market.load_model_performance(model_id, window, resolution))
+
+    @app.post(prefix + "/events")
+    async def add_event(event_data: create_schema):
+        return await market.add_event(event_data)
+
+    @app.patch(prefix + "/events/{event_id}/result")
+    async def set_event_result(event_id: int, data: EventResultSchema, idempotency_key: Optional[str] = Header(None)):
+        status_code, body = await market.settle(event_id, data.result, idempotency_key)
+        return JSONResponse(body, status_code=status_code)
+
+    @app.patch(prefix + "/events/results")
+    async def set_event_results(data: BulkEventResultSchema):
+        """Расчёт пачки событий одной транзакцией; ответ 200 с исходом по каждому событию"""
+        responses = await market.settle_many([(item.event_id, item.result) for item in data.results])
+        return {"settled": sum(r["outcome"] == SettleOutcome.SETTLED for r in responses), "results": responses}
+
+    @app.websocket("/ws" + prefix + "/bubble-map")
+    async def websocket_bubble_map(ws: WebSocket):
+        await market.serve_bubble_map(ws)
+
+    @app.websocket("/ws" + prefix + "/feed")
+    async def websocket_feed(ws: WebSocket, since: int = 0, epoch: Optional[str] = None):
+        await market.serve_feed(ws, since, epoch)
+
+for market in MARKETS:
+    register_market_routes(market)
 
 # -------------------------
 # Shared endpoints
@@ -701,94 +1907,139 @@ async def model_chat(request: ChatRequest):
     model_id = request.model_id
     question = request.question
     
-    system_prompt = MODEL_PROMPTS.get(model_id, MODEL_PROMPTS["gpt"])
+    persona = model_id if model_id in MODEL_PROMPTS else "gpt"
+    system_prompt = MODEL_PROMPTS[persona]
     
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": question}
-            ],
-            temperature=0.8,
-            max_tokens=500
-        )
-        
-        answer = response.choices[0].message.content
+        answer = await llm.chat(persona, system_prompt, question)
         return {"answer": answer}
     
     except Exception as e:
         return {"answer": f"Error: {str(e)}"}
 
-@app.websocket("/ws/bubble-map")
-async def websocket_bubble_map(ws: WebSocket):
-    await manager.connect(ws)
-    try:
-        db = SessionLocal()
-        models = db.query(Model).all()
-        items = [{"model": m.name, "balance": m.balance, "delta": m.balance} for m in models]
-        await ws.send_json({"type":"bubble_map", "data": items})
-        db.close()
-
-        while True:
-            await asyncio.sleep(10**6)
-    except WebSocketDisconnect:
-        manager.disconnect(ws)
+@app.post("/model-chat/stream")
+async def model_chat_stream(request: ChatRequest):
+    """Тот же чат, но токены отдаются через server-sent events по мере генерации"""
+    persona = request.model_id if request.model_id in MODEL_PROMPTS else "gpt"
+    system_prompt = MODEL_PROMPTS[persona]
+
+    async def events():
+        tokens = llm.stream(persona, system_prompt, request.question)
+        try:
+            async for token in tokens:
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+            yield 'data: {"done": true}\n\n'
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        finally:
+            await tokens.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# Состояние, которое дешевле снять в момент scrape, чем обновлять на каждом изменении
+gauge("ws_clients", "Connected WebSocket clients", ("channel",), lambda: {
+    (manager.name,): len(manager.active_connections)
+    for market in MARKETS for manager in (market.bubble_map, market.feed.connections)
+})
+gauge("ws_dropped_messages", "Messages dropped for slow WebSocket clients", ("channel",), lambda: {
+    (manager.name,): manager.dropped_messages
+    for market in MARKETS for manager in (market.bubble_map, market.feed.connections)
+})
+gauge("response_cache_entries", "Cached GET responses", ("market",), lambda: {
+    (market.name,): len(market.cache.entries) for market in MARKETS
+})
+gauge("scheduler_leader", "1 if this process runs the event scheduler", (), lambda: {(): int(scheduler.leader)})
+gauge("scheduler_queued", "Deadlines waiting in the scheduler heap", (), lambda: {(): len(scheduler.heap)})
+gauge("llm_in_flight", "LLM requests in progress", (), lambda: {(): llm.in_flight})
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Профайлер ходит по стекам всех потоков под GIL и отдаёт имена файлов и функций: маршруты есть только
+# при PROFILER_ENABLED=1 (стенд, отладка), иначе /debug/profiler/* - 404
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED") == "1"
+
+if PROFILER_ENABLED:
+    @app.post("/debug/profiler/start")
+    def start_profiler(interval: float = Query(0.01, ge=0.001, le=1), seconds: float = Query(60, gt=0, le=600)):
+        """Включает сэмплирующий профайлер на seconds секунд (или до /debug/profiler/stop)"""
+        if not profiler.start(interval, seconds):
+            raise HTTPException(status_code=409, detail="Profiler is already running")
+        return profiler.stats()
+
+    @app.post("/debug/profiler/stop")
+    def stop_profiler():
+        """Останавливает профайлер и отдаёт collapsed stacks (flamegraph.pl, speedscope)"""
+        return PlainTextResponse(profiler.stop())
+
+@app.get("/ws/stats")
+def get_broadcast_stats():
+    return {
+        **{market.name: market.stats() for market in MARKETS},
+        "bus": bus.stats(),
+        "scheduler": {"leader": scheduler.leader, "owner": scheduler.lease.owner, "failures": scheduler.failures},
+        "archiver": {"last_run": archiver.last_run},
+    }
 
-@app.websocket("/ws/community/bubble-map")
-async def websocket_community_bubble_map(ws: WebSocket):
-    await community_manager.connect(ws)
-    try:
-        db = CommunitySessionLocal()
-        models = db.query(CommunityModel).all()
-        items = [{"model": m.name, "balance": m.balance, "delta": m.balance} for m in models]
-        await ws.send_json({"type":"bubble_map", "data": items})
-        db.close()
+@app.get("/health")
+def get_health():
+    """Liveness: процесс жив и обслуживает запросы, даже пока идёт подготовка баз"""
+    return {"status": "ok"}
 
-        while True:
-            await asyncio.sleep(10**6)
-    except WebSocketDisconnect:
-        community_manager.disconnect(ws)
+@app.get("/ready")
+def get_ready():
+    """Readiness: 200 после подготовки баз и запуска фоновых задач, до этого (или после ошибки) - 503"""
+    return JSONResponse(readiness.report(), status_code=200 if readiness.ready else 503)
 
 # -------------------------
-# Schedulers
+# Startup and shutdown
 # -------------------------
-async def scheduler():
-    while True:
-        db = SessionLocal()
-        upcoming_events = db.query(Event).filter_by(status="upcoming").all()
-        now = datetime.utcnow()
-        for event in upcoming_events:
-            delta = now - event.start_time
-            if delta.total_seconds() >= event.start_in_seconds:
-                event.start_time = now
-                event.end_time = now + timedelta(minutes=event.duration_minutes)
-                event.status = "active"
-                db.commit()
-                await generate_bets(event)
-        db.close()
-        await asyncio.sleep(5)
-
-async def community_scheduler():
-    while True:
-        db = CommunitySessionLocal()
-        upcoming_events = db.query(CommunityEvent).filter_by(status="upcoming").all()
-        now = datetime.utcnow()
-        for event in upcoming_events:
-            delta = now - event.start_time
-            if delta.total_seconds() >= event.start_in_seconds:
-                event.start_time = now
-                event.end_time = now + timedelta(minutes=event.duration_minutes)
-                event.status = "active"
-                db.commit()
-                await generate_community_bets(event)
-        db.close()
-        await asyncio.sleep(5)
-
-@app.on_event("startup")
-async def startup_event():
-    asyncio.create_task(scheduler())
-    asyncio.create_task(community_scheduler())
+async def startup():
+    # Сервер начинает принимать соединения сразу, подготовка идёт фоном; до её конца работает ReadinessGate
+    readiness.task = asyncio.create_task(prepare())
+
+async def prepare():
+    start = time.perf_counter()
+    # Без общей шины воркеры не узнают о чужих записях и отдавали бы устаревшие кэши: такой процесс не становится ready
+    if WORKERS > 1 and not bus.shared:
+        readiness.status, readiness.error = "failed", f"{WORKERS} workers require EVENT_BUS=redis"
+        print(f"❌ Startup refused: {readiness.error}")
+        return
+    try:
+        await run_in_threadpool(prepare_databases)
+        for market in MARKETS:
+            await run_in_threadpool(market.leaderboard.ensure_loaded)
+            market.writer.start()
+        await bus.start()
+        scheduler.start()
+        archiver.start()
+    except Exception as e:
+        readiness.status, readiness.error = "failed", str(e)
+        print(f"❌ Startup failed: {e}")
+        return
+    readiness.status, readiness.startup_seconds = "ready", round(time.perf_counter() - start, 3)
+    print(f"✅ Ready in {readiness.startup_seconds}s")
+
+async def shutdown():
+    if readiness.task is not None and not readiness.task.done():
+        readiness.task.cancel()
+        try:
+            await readiness.task
+        except asyncio.CancelledError:
+            pass
+    # Каждый компонент останавливается независимо: сбой одного не должен оставить недописанными очереди писателей
+    steps = [("archiver", archiver.stop), ("scheduler", scheduler.stop)]
+    steps += [(f"writer {market.name}", market.writer.stop) for market in MARKETS]
+    steps += [("bus", bus.aclose), ("llm", llm.aclose)]
+    for name, stop in steps:
+        try:
+            await stop()
+        except Exception as e:
+            print(f"❌ Shutdown of {name} failed: {e}")
 
 if __name__ == "__main__":
-    uvicorn.run("main_gpt:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # WEB_CONCURRENCY > 1 - несколько воркеров (без reload); для рассылки между ними нужен EVENT_BUS=redis
+    if WORKERS > 1 and not bus.shared:
+        raise SystemExit("❌ WEB_CONCURRENCY > 1 requires a shared event bus: set EVENT_BUS=redis")
+    uvicorn.run("main_gpt:app", host="0.0.0.0", port=8000, reload=WORKERS == 1, workers=WORKERS)
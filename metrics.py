@@ -0,0 +1,244 @@
+import bisect, sys, threading, time
+from collections import Counter as Tally
+from contextvars import ContextVar
+
+# -------------------------
+# Metrics (Prometheus text format)
+# -------------------------
+# Метрики живут в памяти процесса: при нескольких воркерах каждый отдаёт свои, Prometheus различает их по instance
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: observe - bisect и три сложения под блокировкой"""
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {count}"
+
+class Gauge:
+    """Значение снимается при каждом scrape: callback возвращает {кортеж меток: число}"""
+    def __init__(self, name: str, help: str, labels, callback):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in self.callback().items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+class Timer:
+    """with histogram.time(...): - работает и вокруг await"""
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labels=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+def histogram(name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+def gauge(name: str, help: str, labels, callback) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, labels, callback))
+
+# -------------------------
+# HTTP and SQL instrumentation
+# -------------------------
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_QUERIES = histogram("http_request_db_queries", "SQL statements executed per HTTP request",
+                         ("method", "route"), QUERY_BUCKETS)
+DB_QUERIES = counter("db_queries_total", "SQL statements executed", ("db",))
+
+# Счётчик запросов текущего HTTP-запроса. Изменяемый список, а не int: threadpool и run_sync
+# работают с копией контекста, но ссылка на список у них та же
+request_queries = ContextVar("request_queries", default=None)
+
+def count_queries(engine, db: str):
+    """Считает SQL-операторы движка (для AsyncEngine - его sync_engine) в целом и в рамках HTTP-запроса"""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERIES.inc(db)
+        queries = request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность, статус и число SQL-запросов по шаблону маршрута (/events/{event_id}/result),
+    чтобы метки не размножались по id. WebSocket и lifespan проходят без изменений"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        queries = [0]
+        token = request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_queries.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, path, status[0])
+            HTTP_LATENCY.observe(elapsed, method, path)
+            HTTP_QUERIES.observe(queries[0], method, path)
+
+# -------------------------
+# Sampling profiler
+# -------------------------
+class SamplingProfiler:
+    """Включаемый на лету профайлер: фоновый поток раз в interval снимает стеки всех потоков
+    (sys._current_frames) и копит их в формате collapsed stacks - его читают flamegraph.pl и speedscope"""
+    def __init__(self):
+        self.samples = Tally()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.interval = 0.01
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval: float = 0.01, duration: float = 60) -> bool:
+        """False - профайлер уже запущен. duration ограничивает работу, если stop так и не вызовут"""
+        if self.running:
+            return False
+        self.samples = Tally()
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, args=(duration,), name="sampling-profiler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self) -> str:
+        """Останавливает сбор и возвращает стеки: "корень;...;лист число_сэмплов" по строке на стек"""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "samples": sum(self.samples.values()),
+        }
+
+    def _run(self, duration: float):
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self.stopping.wait(self.interval) and time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+profiler = SamplingProfiler()
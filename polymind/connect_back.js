@@ -552,7 +552,7 @@ async function updateBetsTab() {
                     showBlur = true;
                     remainingSeconds = 0;
                 }
-            } else if (event.status === "finished") {
+            } else if (event.status === "finished" || event.status === "closed") {
                 remainingSeconds = 0;
                 showBlur = true;
                 localStorage.removeItem(`timer_${event.id}`);
@@ -659,7 +659,7 @@ async function updateBetsTab() {
 
         eventHistory.forEach(event => {
             const isNotCurrentEvent = !currentEvent || event.id !== currentEvent.id;
-            const isVisible = event.status === 'active' || event.status === 'finished';
+            const isVisible = event.status === 'active' || event.status === 'closed' || event.status === 'finished';
             if (isNotCurrentEvent && isVisible) {
                 allEvents.push(event);
             }
@@ -667,13 +667,14 @@ async function updateBetsTab() {
 
         const statusOrder = {
             active: 0,
-            upcoming: 1,
-            finished: 2
+            closed: 1,
+            upcoming: 2,
+            finished: 3
         };
 
         allEvents.sort((a, b) => {
-            const aStatus = statusOrder[a.status] ?? 3;
-            const bStatus = statusOrder[b.status] ?? 3;
+            const aStatus = statusOrder[a.status] ?? 4;
+            const bStatus = statusOrder[b.status] ?? 4;
 
             if (aStatus !== bStatus) {
                 return aStatus - bStatus;
@@ -1033,15 +1034,12 @@ selectedModel = models[index];
         chatWrap.scrollTop = chatWrap.scrollHeight;
         
         try {
-            const response = await fetch(`${API_URL}/model-chat`, {
+            const response = await fetch(`${API_URL}/model-chat/stream`, {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
                 body: JSON.stringify({model_id: selectedModel, question})
             });
             
-            const data = await response.json();
-            
-            // Добавляем ответ AI
             const aiMsg = document.createElement('div');
             aiMsg.className = 'ai-chat__el _ai';
             
@@ -1056,10 +1054,29 @@ selectedModel = models[index];
             `;
             chatWrap.appendChild(aiMsg);
             
+            // Server-sent events: дописываем токены по мере поступления
             const aiParagraph = aiMsg.querySelector('p');
-            initTextAnimation(aiParagraph, data.answer);
-            
-            chatWrap.scrollTop = chatWrap.scrollHeight;
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+
+                events.forEach(event => {
+                    const dataLine = event.split('\n').find(line => line.startsWith('data: '));
+                    if (!dataLine) return;
+                    const msg = JSON.parse(dataLine.slice(6));
+                    if (msg.token) aiParagraph.textContent += msg.token;
+                    if (msg.error) aiParagraph.textContent += `Error: ${msg.error}`;
+                });
+                chatWrap.scrollTop = chatWrap.scrollHeight;
+            }
             
         } catch (error) {
             console.error('Error sending message:', error);
@@ -1073,6 +1090,40 @@ selectedModel = models[index];
 }
 
 
+// Live feed: the server pushes numbered messages, we resume from the last seq on reconnect
+function connectFeed(url, onMessage) {
+    let lastSeq = 0;
+    let epoch = null;
+    let retryDelay = 1000;
+
+    const open = () => {
+        const query = epoch ? `?since=${lastSeq}&epoch=${epoch}` : '';
+        const ws = new WebSocket(url + query);
+
+        ws.onmessage = (e) => {
+            const msg = JSON.parse(e.data);
+            // A gap in seq means messages were lost: reconnect and resume from lastSeq
+            if (msg.seq && msg.type !== 'snapshot' && msg.epoch === epoch && msg.seq !== lastSeq + 1) {
+                ws.close();
+                return;
+            }
+            if (msg.epoch) epoch = msg.epoch;
+            if (msg.seq) lastSeq = msg.seq;
+            retryDelay = 1000;
+            onMessage(msg);
+        };
+
+        ws.onclose = () => {
+            setTimeout(open, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    };
+
+    open();
+}
+
+const FEED_URL = `${API_URL.replace(/^http/, 'ws')}/ws/feed`;
+
 async function initApp() {
 
     await updateHeaderBalances();
@@ -1083,22 +1134,31 @@ async function initApp() {
     initAIChat();
     
 
-    setInterval(async () => {
-        await updateHeaderBalances();
-        await updateAISquare();
-        await updateBetsTab();
-        await updateResultsTab();
-    }, 20000);
+    connectFeed(FEED_URL, async (msg) => {
+        if (msg.type === 'snapshot' || msg.type === 'leaderboard') {
+            await updateHeaderBalances();
+            await updateAISquare();
+            await updateBubbleMap();
+        }
+        if (msg.type !== 'leaderboard') {
+            await updateBetsTab();
+        }
+        if (msg.type === 'snapshot' || msg.type === 'event_settled') {
+            await updateResultsTab();
+        }
+    });
 }
 
 async function initLeaderboard() {
     await updateHeaderBalances();
     await updateLeaderboard();
 
-    setInterval(async () => {
-        await updateHeaderBalances();
-        await updateLeaderboard();
-    }, 20000);
+    connectFeed(FEED_URL, async (msg) => {
+        if (msg.type === 'snapshot' || msg.type === 'leaderboard') {
+            await updateHeaderBalances();
+            await updateLeaderboard();
+        }
+    });
 }
 
 
@@ -1182,8 +1242,6 @@ async function updateBubbleMap() {
     }
 }
 
-setInterval(updateBubbleMap, 5000);
-
 updateBubbleMap();
 
 
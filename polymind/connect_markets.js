@@ -494,7 +494,7 @@ async function updateBetsTab() {
                     showBlur = true;
                     remainingSeconds = 0;
                 }
-            } else if (event.status === "finished") {
+            } else if (event.status === "finished" || event.status === "closed") {
                 remainingSeconds = 0;
                 showBlur = true;
                 localStorage.removeItem(`community_timer_${event.id}`);
@@ -607,7 +607,7 @@ async function updateBetsTab() {
 
         eventHistory.forEach(event => {
             const isNotCurrentEvent = !currentEvent || event.id !== currentEvent.id;
-            const isVisible = event.status === 'active' || event.status === 'finished';
+            const isVisible = event.status === 'active' || event.status === 'closed' || event.status === 'finished';
             if (isNotCurrentEvent && isVisible) {
                 allEvents.push(event);
             }
@@ -615,13 +615,14 @@ async function updateBetsTab() {
 
         const statusOrder = {
             active: 0,
-            upcoming: 1,
-            finished: 2
+            closed: 1,
+            upcoming: 2,
+            finished: 3
         };
 
         allEvents.sort((a, b) => {
-            const aStatus = statusOrder[a.status] ?? 3;
-            const bStatus = statusOrder[b.status] ?? 3;
+            const aStatus = statusOrder[a.status] ?? 4;
+            const bStatus = statusOrder[b.status] ?? 4;
 
             if (aStatus !== bStatus) {
                 return aStatus - bStatus;
@@ -979,14 +980,12 @@ function initAIChat() {
         chatWrap.scrollTop = chatWrap.scrollHeight;
         
         try {
-            const response = await fetch(`https://api.polymind.me:443/model-chat`, {
+            const response = await fetch(`https://api.polymind.me:443/model-chat/stream`, {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
                 body: JSON.stringify({model_id: selectedModel, question})
             });
             
-            const data = await response.json();
-            
             const aiMsg = document.createElement('div');
             aiMsg.className = 'ai-chat__el _ai';
             
@@ -1001,10 +1000,29 @@ function initAIChat() {
             `;
             chatWrap.appendChild(aiMsg);
             
+            // Server-sent events: дописываем токены по мере поступления
             const aiParagraph = aiMsg.querySelector('p');
-            initTextAnimation(aiParagraph, data.answer);
-            
-            chatWrap.scrollTop = chatWrap.scrollHeight;
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split('\n\n');
+                buffer = events.pop();
+
+                events.forEach(event => {
+                    const dataLine = event.split('\n').find(line => line.startsWith('data: '));
+                    if (!dataLine) return;
+                    const msg = JSON.parse(dataLine.slice(6));
+                    if (msg.token) aiParagraph.textContent += msg.token;
+                    if (msg.error) aiParagraph.textContent += `Error: ${msg.error}`;
+                });
+                chatWrap.scrollTop = chatWrap.scrollHeight;
+            }
             
         } catch (error) {
             console.error('Ошибка отправки сообщения:', error);
@@ -1489,6 +1507,40 @@ if (window.MutationObserver) {
 // ============================================
 // Инициализация приложения
 // ============================================
+// Live feed: сервер присылает нумерованные сообщения, после переподключения докачиваем с последнего seq
+function connectFeed(url, onMessage) {
+    let lastSeq = 0;
+    let epoch = null;
+    let retryDelay = 1000;
+
+    const open = () => {
+        const query = epoch ? `?since=${lastSeq}&epoch=${epoch}` : '';
+        const ws = new WebSocket(url + query);
+
+        ws.onmessage = (e) => {
+            const msg = JSON.parse(e.data);
+            // Дыра в нумерации - сообщения потеряны: переподключаемся и докачиваем с lastSeq
+            if (msg.seq && msg.type !== 'snapshot' && msg.epoch === epoch && msg.seq !== lastSeq + 1) {
+                ws.close();
+                return;
+            }
+            if (msg.epoch) epoch = msg.epoch;
+            if (msg.seq) lastSeq = msg.seq;
+            retryDelay = 1000;
+            onMessage(msg);
+        };
+
+        ws.onclose = () => {
+            setTimeout(open, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    };
+
+    open();
+}
+
+const COMMUNITY_FEED_URL = COMMUNITY_API_URL.replace(/^http/, 'ws').replace(/\/community$/, '/ws/community/feed');
+
 async function initCommunityApp() {
     await updateHeaderBalances();
     await updateBetsTab();
@@ -1496,21 +1548,30 @@ async function initCommunityApp() {
     
     initAIChat();
     
-    setInterval(async () => {
-        await updateHeaderBalances();
-        await updateBetsTab();
-        await updateResultsTab();
-    }, 20000);
+    connectFeed(COMMUNITY_FEED_URL, async (msg) => {
+        if (msg.type === 'snapshot' || msg.type === 'leaderboard') {
+            await updateHeaderBalances();
+            await updateBubbleMap();
+        }
+        if (msg.type !== 'leaderboard') {
+            await updateBetsTab();
+        }
+        if (msg.type === 'snapshot' || msg.type === 'event_settled') {
+            await updateResultsTab();
+        }
+    });
 }
 
 async function initCommunityLeaderboard() {
     await updateHeaderBalances();
     await updateLeaderboard();
 
-    setInterval(async () => {
-        await updateHeaderBalances();
-        await updateLeaderboard();
-    }, 20000);
+    connectFeed(COMMUNITY_FEED_URL, async (msg) => {
+        if (msg.type === 'snapshot' || msg.type === 'leaderboard') {
+            await updateHeaderBalances();
+            await updateLeaderboard();
+        }
+    });
 }
 
 // ============================================
@@ -1526,9 +1587,8 @@ document.addEventListener('DOMContentLoaded', () => {
         // Это community-markets.html
         initCommunityApp();
         
-        // Запускаем bubble map
+        // Запускаем bubble map (дальше обновляется из live feed)
         updateBubbleMap();
-        setInterval(updateBubbleMap, 5000);
         
         adjustBubbleMapHeight();
         setTimeout(adjustBubbleMapHeight, 100);
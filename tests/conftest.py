@@ -0,0 +1,43 @@
+import os, sys
+
+import pytest
+
+# Модули сервиса лежат в корне репозитория, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def market(tmp_path):
+    """Основной рынок на временной БД: схема, миграции и модели, как при старте сервиса"""
+    from main_gpt import MAIN_TABLES, MODEL_NAMES, Market
+
+    market = Market("test", "", str(tmp_path / "arena.db"), MAIN_TABLES)
+    market.migrate()
+    market.seed_models(MODEL_NAMES)
+    yield market
+    market.engine.dispose()
+    market.archive.engine.dispose()
+
+@pytest.fixture
+def add_event(market):
+    """add_event(status, {model_id: (side, amount)}) -> id события со ставками"""
+    from sqlalchemy import select
+
+    from main_gpt import SideEnum, place_bets
+
+    def add(status="active", bets=None):
+        E = market.event_cls
+        db = market.SessionLocal()
+        event = E(description="test", status=status, start_in_seconds=0, duration_minutes=5)
+        db.add(event)
+        db.flush()
+        if bets:
+            # Остальные модели ставят NO 100, а не случайно: исход теста не зависит от random
+            chosen = {model_id: (SideEnum.NO, 100) for model_id in db.execute(select(market.model_cls.id)).scalars()}
+            chosen.update({model_id: (SideEnum(side), amount) for model_id, (side, amount) in bets.items()})
+            place_bets(db, E, market.bet_cls, market.model_cls, [event.id], {event.id: chosen})
+        db.commit()
+        event_id = event.id
+        db.close()
+        return event_id
+
+    return add
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import main_gpt
+from main_gpt import BET_MAX, BET_MIN, SideEnum, agent_bets, parse_bet
+
+@pytest.mark.parametrize("answer, expected", [
+    ('{"side": "YES", "amount": 300, "reasoning": "sure"}', (SideEnum.YES, 300)),
+    ('Sure! {"side": "no", "amount": "250.7"} good luck', (SideEnum.NO, 250)),
+    ('{"side": "YES", "amount": 5}', (SideEnum.YES, BET_MIN)),
+    ('{"side": "NO", "amount": 99999}', (SideEnum.NO, BET_MAX)),
+])
+def test_parse_bet_valid(answer, expected):
+    assert parse_bet(answer) == expected
+
+@pytest.mark.parametrize("answer", [
+    None,
+    "",
+    "YES, 300",
+    '{"side": "MAYBE", "amount": 300}',
+    '{"side": "YES"}',
+    '{"side": "YES", "amount": "lots"}',
+    '{"side": "YES", "amount": null}',
+    '{"side": "YES", "amount": 1e999}',
+    '{"side": "YES", "amount": "Infinity"}',
+    '{"side": "NO", "amount": "-inf"}',
+    '{"side": "NO", "amount": NaN}',
+])
+def test_parse_bet_invalid(answer):
+    assert parse_bet(answer) is None
+
+def test_agent_bets_falls_back_per_agent(monkeypatch):
+    async def agent_bet(model_id, event):
+        if model_id == "grok":
+            raise OverflowError("bad stake")
+        return (SideEnum.YES, 300), "llm"
+
+    monkeypatch.setattr(main_gpt, "agent_bet", agent_bet)
+    events = [{"id": 1, "description": "a"}, {"id": 2, "description": "b"}]
+    decisions = asyncio.run(agent_bets(["gpt", "grok"], events))
+    assert set(decisions) == {1, 2}
+    for chosen in decisions.values():
+        assert chosen["gpt"] == (SideEnum.YES, 300)
+        side, amount = chosen["grok"]
+        assert side in (SideEnum.YES, SideEnum.NO) and BET_MIN <= amount <= BET_MAX
+
+def test_agent_bet_unparsed_answer_is_random(monkeypatch):
+    async def predict(system_prompt, question):
+        return '{"side": "YES", "amount": 1e999}'
+
+    monkeypatch.setattr(main_gpt, "AGENT_BETS", "llm")
+    monkeypatch.setattr(main_gpt.llm, "predict", predict)
+    (side, amount), source = asyncio.run(main_gpt.agent_bet("gpt", {"description": "a"}))
+    assert source == "unparsed"
+    assert BET_MIN <= amount <= BET_MAX
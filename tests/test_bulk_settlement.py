@@ -0,0 +1,73 @@
+from main_gpt import SideEnum, coalesce_bubble_map
+
+def settle_many(market, results):
+    db = market.SessionLocal()
+    try:
+        result = market.settle_many_sync(db, [(event_id, SideEnum(side)) for event_id, side in results])
+        db.commit()
+        return result
+    finally:
+        db.close()
+
+def balances(market):
+    db = market.SessionLocal()
+    rows = {model.id: model.balance for model in db.query(market.model_cls)}
+    db.close()
+    return rows
+
+def test_batch_sums_deltas_per_model(market, add_event):
+    first = add_event(bets={"gpt": ("YES", 300)})
+    second = add_event(bets={"gpt": ("YES", 300)})
+    responses, settled, touched = settle_many(market, [(first, "YES"), (second, "YES")])
+
+    assert [r["outcome"] for r in responses] == ["settled", "settled"]
+    assert [event["event_id"] for event in settled] == [first, second]
+    # Модели пачки - общие объекты сессии: второй расчёт начинается с баланса после первого
+    assert balances(market)["gpt"] == 11000
+    assert balances(market)["grok"] == 9800
+    merged = {item["model"]: item for item in coalesce_bubble_map(settled)}
+    assert merged["GPT"] == {"model": "GPT", "balance": 11000, "delta": 1000}
+    assert merged["Grok"] == {"model": "Grok", "balance": 9800, "delta": -200}
+    assert len(touched) == 6 and {model["id"]: model for model in touched}["gpt"]["balance"] == 11000
+
+def test_duplicate_ids_in_one_batch_pay_once(market, add_event):
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    responses, settled, _ = settle_many(market, [(event_id, "YES"), (event_id, "YES"), (event_id, "NO")])
+    assert [r["outcome"] for r in responses] == ["settled", "already_settled", "conflict"]
+    assert [r["status_code"] for r in responses] == [200, 200, 409]
+    assert len(settled) == 1
+    assert balances(market)["gpt"] == 10500
+
+def test_mixed_outcomes(market, add_event):
+    active = add_event(bets={"gpt": ("YES", 300)})
+    upcoming = add_event(status="upcoming")
+    finished = add_event(bets={"gpt": ("YES", 300)})
+    settle_many(market, [(finished, "NO")])
+    before = balances(market)
+
+    responses, settled, _ = settle_many(market, [(active, "YES"), (upcoming, "YES"), (999, "NO"), (finished, "YES")])
+    assert [(r["event_id"], r["outcome"], r["status_code"]) for r in responses] == [
+        (active, "settled", 200), (upcoming, "not_started", 409), (999, "not_found", 404), (finished, "conflict", 409),
+    ]
+    assert [event["event_id"] for event in settled] == [active]
+    assert balances(market)["gpt"] == before["gpt"] + 500
+
+def test_repeating_a_batch_is_safe(market, add_event):
+    ids = [add_event(bets={"gpt": ("YES", 300)}) for _ in range(3)]
+    settle_many(market, [(event_id, "YES") for event_id in ids])
+    after = balances(market)
+    responses, settled, touched = settle_many(market, [(event_id, "YES") for event_id in ids])
+    assert {r["outcome"] for r in responses} == {"already_settled"}
+    assert (settled, touched) == ([], [])
+    assert balances(market) == after
+
+def test_coalesce_bubble_map_keeps_last_balance():
+    settled = [
+        {"event_id": 1, "bubble_map": [{"model": "GPT", "balance": 10100, "delta": 100},
+                                       {"model": "Grok", "balance": 9900, "delta": -100}]},
+        {"event_id": 2, "bubble_map": [{"model": "GPT", "balance": 10050, "delta": -50}]},
+    ]
+    assert coalesce_bubble_map(settled) == [
+        {"model": "GPT", "balance": 10050, "delta": 50},
+        {"model": "Grok", "balance": 9900, "delta": -100},
+    ]
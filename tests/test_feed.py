@@ -0,0 +1,39 @@
+import asyncio
+
+from main_gpt import ConnectionManager, MarketFeed
+
+def make_feed(count, backlog=10):
+    feed = MarketFeed(ConnectionManager("test:feed"), backlog=backlog)
+
+    async def publish():
+        for i in range(count):
+            await feed.publish("test", {"i": i})
+
+    asyncio.run(publish())
+    return feed
+
+def seqs(messages):
+    return [message["seq"] for message in messages]
+
+def test_replay_returns_messages_after_since():
+    feed = make_feed(8)
+    assert seqs(feed.replay(5, feed.epoch)) == [6, 7, 8]
+
+def test_replay_up_to_date_client_gets_nothing():
+    feed = make_feed(8)
+    assert feed.replay(8, feed.epoch) == []
+
+def test_replay_needs_snapshot_for_another_epoch():
+    feed = make_feed(3)
+    assert feed.replay(1, "other") is None
+    assert feed.replay(0, None) is None
+
+def test_replay_needs_snapshot_when_backlog_was_trimmed():
+    feed = make_feed(15, backlog=10)
+    # В буфере seq 6..15: с since=5 ничего не потеряно, с since=4 пропал seq 5
+    assert seqs(feed.replay(5, feed.epoch)) == list(range(6, 16))
+    assert feed.replay(4, feed.epoch) is None
+
+def test_replay_rejects_since_from_the_future():
+    feed = make_feed(3)
+    assert feed.replay(4, feed.epoch) is None
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from main_gpt import Base, Leaderboard, Model, model_row
+
+NAMES = ["GPT", "Claude", "Gemini Pro", "Grok", "DeepSeek", "Qwen Max"]
+
+@pytest.fixture
+def leaderboard(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'arena.db'}")
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(bind=engine)
+    db = SessionLocal()
+    db.add_all(Model(id=name.lower().replace(" ", "_"), name=name, balance=10000, wins=0, total_bets=0,
+                     biggest_win=0, biggest_loss=0) for name in NAMES)
+    db.commit()
+    models = {model.id: model_row(model) for model in db.query(Model).all()}
+    db.close()
+    board = Leaderboard(SessionLocal, Model)
+    board.ensure_loaded()
+    return board, models
+
+def full_ranking(models, order):
+    """Эталон: полная сортировка, как делал рейтинг до материализации"""
+    rows = sorted(models.values(), key=lambda m: (-Leaderboard.build_row(m)["return_percent"],
+                                                 -Leaderboard.build_row(m)["win_rate"], order[m["id"]]))
+    return [m["name"] for m in rows]
+
+def test_initial_order_keeps_database_order_on_ties(leaderboard):
+    board, _ = leaderboard
+    assert [row["model"] for row in board.page()] == NAMES
+    assert [row["rank"] for row in board.page()] == list(range(1, len(NAMES) + 1))
+
+def test_update_moves_model_and_reports_rank_changes(leaderboard):
+    board, models = leaderboard
+    grok = dict(models["grok"], balance=10500, wins=1, total_bets=1)
+    changes = board.update([grok])
+    assert board.page(limit=1)[0]["model"] == "Grok"
+    assert {"model": "Grok", "rank": 1, "previous_rank": 4} in changes
+    # Сдвинулись все, кто стоял выше Grok, и никто ниже
+    assert sorted(change["model"] for change in changes) == ["Claude", "GPT", "Gemini Pro", "Grok"]
+
+def test_incremental_updates_match_full_sort(leaderboard):
+    board, models = leaderboard
+    order = {model_id: idx for idx, model_id in enumerate(models)}
+    rng = random.Random(7)
+    for _ in range(200):
+        touched = []
+        for model_id in rng.sample(list(models), rng.randint(1, 3)):
+            model = models[model_id]
+            won = rng.random() < 0.5
+            models[model_id] = dict(model, balance=model["balance"] + rng.randint(-300, 300),
+                                    wins=model["wins"] + won, total_bets=model["total_bets"] + 1)
+            touched.append(models[model_id])
+        board.update(touched)
+        page = board.page()
+        assert [row["model"] for row in page] == full_ranking(models, order)
+        assert [row["rank"] for row in page] == list(range(1, len(NAMES) + 1))
+
+def test_page_offset_and_limit(leaderboard):
+    board, _ = leaderboard
+    assert [row["model"] for row in board.page(offset=4, limit=2)] == NAMES[4:6]
+    assert board.page(offset=10) == []
@@ -0,0 +1,30 @@
+from main_gpt import PerformanceWindow, SideEnum, model_performance
+
+def settle(market, event_id, result):
+    db = market.SessionLocal()
+    market.settle_sync(db, event_id, SideEnum(result), None)
+    db.commit()
+    db.close()
+
+def performance(market, model_id, window=PerformanceWindow.DAY):
+    db = market.SessionLocal()
+    data = model_performance(db, market.history_cls, model_id, window)
+    db.close()
+    return data
+
+def test_win_with_zero_payout_counts_as_win(market, add_event):
+    # Все поставили NO: проигравших нет, выплата победителям нулевая, но это победа - как в Model.wins
+    event_id = add_event(bets={"gpt": ("NO", 200)})
+    settle(market, event_id, "NO")
+    data = performance(market, "gpt")
+    assert data["bets"] == 1
+    assert data["win_rate"] == 100
+
+def test_win_rate_matches_leaderboard(market, add_event):
+    for side, result in (("YES", "YES"), ("YES", "NO"), ("NO", "NO"), ("YES", "NO")):
+        settle(market, add_event(bets={"gpt": (side, 300)}), result)
+    data = performance(market, "gpt", PerformanceWindow.ALL)
+    market.leaderboard.ensure_loaded()
+    row = next(row for row in market.leaderboard.page() if row["model"] == "GPT")
+    assert data["bets"] == 4
+    assert data["win_rate"] == row["win_rate"] == 50
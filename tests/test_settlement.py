@@ -0,0 +1,93 @@
+from sqlalchemy import func, select
+
+from main_gpt import SettleOutcome, SideEnum, settle_event
+
+def run(market, fn, *args):
+    """Операция писателя в своей транзакции, как её выполнил бы WriteQueue"""
+    db = market.SessionLocal()
+    try:
+        result = fn(db, *args)
+        db.commit()
+        return result
+    finally:
+        db.close()
+
+def settle(market, event_id, result):
+    return run(market, lambda db: settle_event(db, market.event_cls, market.bet_cls, market.model_cls,
+                                               market.history_cls, event_id, SideEnum(result)))
+
+def balance(market, model_id):
+    return run(market, lambda db: db.get(market.model_cls, model_id).balance)
+
+def history_rows(market, event_id):
+    H = market.history_cls
+    return run(market, lambda db: db.execute(select(func.count()).where(H.event_id == event_id)).scalar())
+
+def test_settle_pays_winners_from_losers_pool(market, add_event):
+    # GPT один на YES (300), пятеро на NO по 100: пул проигравших 500 целиком уходит GPT
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    outcome, items, touched = settle(market, event_id, "YES")
+    assert outcome == SettleOutcome.SETTLED
+    assert balance(market, "gpt") == 10500
+    assert balance(market, "grok") == 9900
+    assert {item["model"]: item["delta"] for item in items}["GPT"] == 500
+    assert len(touched) == 6
+    assert history_rows(market, event_id) == 6
+
+def test_repeated_settle_does_not_pay_twice(market, add_event):
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    settle(market, event_id, "YES")
+    outcome, items, touched = settle(market, event_id, "YES")
+    assert (outcome, items, touched) == (SettleOutcome.ALREADY_SETTLED, [], [])
+    assert balance(market, "gpt") == 10500
+    assert history_rows(market, event_id) == 6
+
+def test_settle_with_other_result_is_conflict(market, add_event):
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    settle(market, event_id, "YES")
+    assert settle(market, event_id, "NO")[0] == SettleOutcome.CONFLICT
+    assert balance(market, "gpt") == 10500
+
+def test_settle_unknown_and_upcoming_events(market, add_event):
+    upcoming = add_event(status="upcoming")
+    assert settle(market, 999, "YES")[0] == SettleOutcome.NOT_FOUND
+    assert settle(market, upcoming, "YES")[0] == SettleOutcome.NOT_STARTED
+
+def test_settle_sync_status_codes(market, add_event):
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    upcoming = add_event(status="upcoming")
+    cases = [(event_id, "YES", 200, "settled"), (event_id, "YES", 200, "already_settled"),
+             (event_id, "NO", 409, None), (999, "YES", 404, None), (upcoming, "YES", 409, None)]
+    for target, result, status_code, outcome in cases:
+        code, body, _ = run(market, market.settle_sync, target, SideEnum(result), None)
+        assert code == status_code
+        assert body.get("outcome") == outcome
+
+def test_idempotency_key_replays_stored_response(market, add_event):
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    first = run(market, market.settle_sync, event_id, SideEnum.YES, "key-1")
+    replay = run(market, market.settle_sync, event_id, SideEnum.YES, "key-1")
+    assert first[:2] == (200, {"status": "ok", "outcome": "settled", "event_id": event_id, "result": "YES"})
+    # Повтор - тот же ответ, без расчёта и без рассылки
+    assert replay == (200, first[1], None)
+    assert balance(market, "gpt") == 10500
+
+def test_idempotency_key_replays_error_response(market):
+    first = run(market, market.settle_sync, 999, SideEnum.YES, "key-404")
+    assert run(market, market.settle_sync, 999, SideEnum.YES, "key-404") == first == (404, {"detail": "Event not found"}, None)
+
+def test_idempotency_key_reused_for_another_request(market, add_event):
+    event_id = add_event(bets={"gpt": ("YES", 300)})
+    other = add_event(bets={"gpt": ("YES", 300)})
+    run(market, market.settle_sync, event_id, SideEnum.YES, "key-2")
+
+    code, body, settled = run(market, market.settle_sync, other, SideEnum.YES, "key-2")
+    assert (code, settled) == (422, None)
+    assert "another event" in body["detail"]
+
+    code, body, settled = run(market, market.settle_sync, event_id, SideEnum.NO, "key-2")
+    assert (code, settled) == (422, None)
+    assert "different result" in body["detail"]
+    # Ни один из отклонённых запросов ничего не рассчитал
+    assert balance(market, "gpt") == 10500
+    assert history_rows(market, other) == 0
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from metrics import count_queries, request_queries
+from writer import WRITE_RETRIES, WriteQueue
+
+def make_queue(tmp_path, name, window=0.05):
+    engine = create_engine(f"sqlite:///{tmp_path / 'writer.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT UNIQUE)"))
+    return engine, WriteQueue(name, sessionmaker(bind=engine), window=window)
+
+def insert(db, value):
+    db.execute(text("INSERT INTO items (value) VALUES (:value)"), {"value": value})
+    return value
+
+def insert_then_fail(db, value):
+    insert(db, value)
+    raise ValueError("boom")
+
+def values(engine):
+    with engine.connect() as conn:
+        return sorted(conn.execute(text("SELECT value FROM items")).scalars())
+
+def test_batch_commits_every_operation(tmp_path):
+    engine, queue = make_queue(tmp_path, "test-batch")
+
+    async def main():
+        queue.start()
+        results = await asyncio.gather(*(queue.submit(insert, f"v{i}") for i in range(5)))
+        await queue.stop()
+        return results
+
+    assert asyncio.run(main()) == [f"v{i}" for i in range(5)]
+    assert values(engine) == [f"v{i}" for i in range(5)]
+    # Все пять операций пришли в одно окно и ушли одним commit
+    assert queue.batches == 1 and queue.operations == 5
+
+def test_failed_operation_rolls_back_only_itself(tmp_path):
+    engine, queue = make_queue(tmp_path, "test-retry")
+    retries = WRITE_RETRIES.values.get(("test-retry",), 0)
+
+    async def main():
+        queue.start()
+        results = await asyncio.gather(
+            queue.submit(insert, "a"),
+            queue.submit(insert_then_fail, "b"),
+            queue.submit(insert, "c"),
+            return_exceptions=True,
+        )
+        await queue.stop()
+        return results
+
+    first, failed, last = asyncio.run(main())
+    assert (first, last) == ("a", "c")
+    assert isinstance(failed, ValueError)
+    # Строка виновника откатилась, остальные пережили повтор по одной
+    assert values(engine) == ["a", "c"]
+    assert WRITE_RETRIES.values[("test-retry",)] == retries + 1
+
+def test_single_failed_operation_is_not_retried(tmp_path):
+    engine, queue = make_queue(tmp_path, "test-single", window=0)
+    retries = WRITE_RETRIES.values.get(("test-single",), 0)
+
+    async def main():
+        queue.start()
+        with pytest.raises(ValueError):
+            await queue.submit(insert_then_fail, "x")
+        await queue.stop()
+
+    asyncio.run(main())
+    assert values(engine) == []
+    assert WRITE_RETRIES.values.get(("test-single",), 0) == retries
+
+def test_stop_drains_queued_operations(tmp_path):
+    engine, queue = make_queue(tmp_path, "test-drain", window=0)
+
+    async def main():
+        queue.start()
+        pending = [asyncio.create_task(queue.submit(insert, f"v{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        await queue.stop()
+        return await asyncio.gather(*pending)
+
+    assert asyncio.run(main()) == ["v0", "v1", "v2"]
+    assert values(engine) == ["v0", "v1", "v2"]
+
+def test_operation_sql_is_counted_for_the_caller(tmp_path):
+    engine, queue = make_queue(tmp_path, "test-context", window=0)
+    count_queries(engine, "test-context")
+
+    async def main():
+        queue.start()
+        queries = [0]
+        token = request_queries.set(queries)
+        try:
+            await queue.submit(insert, "v")
+        finally:
+            request_queries.reset(token)
+        await queue.stop()
+        return queries[0]
+
+    # INSERT операции выполняется в потоке писателя, но засчитывается запросу, который её поставил
+    assert asyncio.run(main()) == 1
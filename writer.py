@@ -0,0 +1,137 @@
+import asyncio, contextvars
+
+from starlette.concurrency import run_in_threadpool
+
+from metrics import counter, gauge, histogram
+
+WRITE_BATCH_SIZE = histogram("db_write_batch_size", "Write operations committed together", ("db",),
+                             (1, 2, 4, 8, 16, 32, 64, 128, 256))
+WRITE_BATCH_LATENCY = histogram("db_write_batch_duration_seconds", "Executing and committing one write batch", ("db",))
+WRITE_RETRIES = counter("db_write_batch_retries_total", "Write batches re-run one operation per transaction", ("db",))
+
+QUEUES = []
+gauge("db_write_queue_depth", "Write operations waiting for the writer", ("db",),
+      lambda: {(queue.name,): queue.queue.qsize() for queue in QUEUES})
+
+# -------------------------
+# Single writer per database
+# -------------------------
+class WriteQueue:
+    """Единственный писатель SQLite-базы: операции копятся в очереди и выполняются пачкой в одной транзакции
+    с одним commit (group commit), поэтому запросы не дерутся за блокировку записи и fsync делится на пачку.
+
+    Операция - синхронная функция fn(db, *args) на сессии писателя: она не делает commit/rollback и возвращает
+    готовые данные, а не ORM-объекты (после commit они протухают). Ошибка одной операции откатывает пачку,
+    после чего операции повторяются по одной в своих транзакциях - исключение получает только виновник.
+    Операция выполняется в контексте (contextvars) вызвавшего submit: её SQL засчитывается его HTTP-запросу"""
+    def __init__(self, name: str, session_factory, window: float = 0.002, max_batch: int = 64, max_queue: int = 10000):
+        self.name = name
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.task = None
+        self.batches = 0
+        self.operations = 0
+        QUEUES.append(self)
+
+    async def submit(self, fn, *args):
+        """Ставит операцию в очередь и ждёт commit её пачки; возвращает результат fn"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((fn, args, future, contextvars.copy_context()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Ждём попутчиков не дольше window; всё, что накопилось за время прошлого commit, уже в очереди
+            deadline = loop.time() + self.window
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - loop.time()
+                    item = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self.commit(batch)
+            if stop:
+                return
+
+    async def commit(self, batch):
+        try:
+            with WRITE_BATCH_LATENCY.time(self.name):
+                results = await run_in_threadpool(self.execute, [(fn, args, ctx) for fn, args, _, ctx in batch])
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+        WRITE_BATCH_SIZE.observe(len(batch), self.name)
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, _, future, _), (ok, value) in zip(batch, results):
+            if future.cancelled():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def execute(self, operations):
+        """Выполняется в потоке: [(fn, args, контекст)] -> [(успех, результат или исключение)]"""
+        db = self.session_factory()
+        try:
+            try:
+                results = []
+                for fn, args, ctx in operations:
+                    results.append((True, ctx.run(self.apply, db, fn, args)))
+                    # Следующая операция пачки видит изменения этой, в том числе сделанные Core-UPDATE мимо ORM
+                    db.expire_all()
+                db.commit()
+                return results
+            except Exception as e:
+                db.rollback()
+                if len(operations) == 1:
+                    return [(False, e)]
+
+            WRITE_RETRIES.inc(self.name)
+            results = []
+            for fn, args, ctx in operations:
+                try:
+                    value = ctx.run(self.apply, db, fn, args)
+                    db.commit()
+                    results.append((True, value))
+                except Exception as e:
+                    db.rollback()
+                    results.append((False, e))
+            return results
+        finally:
+            db.close()
+
+    @staticmethod
+    def apply(db, fn, args):
+        # flush здесь же: INSERT/UPDATE из ORM выполняются в контексте своей операции
+        value = fn(db, *args)
+        db.flush()
+        return value
+
+    def start(self):
+        # Очередь создаётся заново в цикле событий, где будет жить писатель
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Дописывает уже поставленные операции и останавливает писателя"""
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "batches": self.batches, "operations": self.operations}